@@ -0,0 +1,187 @@
+# 聊天记录的 model/view
+# 每条消息只是 model 里的一行数据，气泡由 delegate 在可见时绘制，不再预先创建成千上万个 QLabel
+# 所有气泡共用同一张头像 QPixmap，对话长度也不再有上限
+import os
+
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QRect, QSize
+from PyQt5.QtGui import QFont, QFontMetrics, QPixmap, QColor, QPainter
+from PyQt5.QtWidgets import QListView, QStyledItemDelegate, QAbstractItemView
+
+USER = 'user'
+ROBOT = 'robot'
+
+AVATAR_SIZE = 35
+BUBBLE_PADDING = 12  # 和原来 QLabel adjustSize 之后再加 25 的效果差不多
+SPACING = 10
+
+
+class ChatModel(QAbstractListModel):
+    # 每一行是一个气泡：说话人、文字，以及天气/时间回复用的图片
+    SpeakerRole = Qt.UserRole + 1
+    PixmapRole = Qt.UserRole + 2
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.messages = []
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.messages)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        message = self.messages[index.row()]
+        if role == Qt.DisplayRole:
+            return message['text']
+        if role == self.SpeakerRole:
+            return message['speaker']
+        if role == self.PixmapRole:
+            return message['pixmap']
+        return None
+
+    def addMessage(self, speaker, text, pixmap=None):
+        # 在末尾添加一个气泡，返回它的行号
+        row = len(self.messages)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.messages.append({'speaker': speaker, 'text': text, 'pixmap': pixmap})
+        self.endInsertRows()
+        return row
+
+    def setMessage(self, row, text, pixmap=None):
+        # 替换某个气泡的内容，比如把 "typing..." 换成真正的回复
+        self.messages[row]['text'] = text
+        self.messages[row]['pixmap'] = pixmap
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def text(self, row):
+        return self.messages[row]['text']
+
+
+class ChatDelegate(QStyledItemDelegate):
+    # 负责计算气泡大小并绘制：用户的气泡靠右，机器人的靠左
+    def __init__(self, view, user_avatar, robot_avatar):
+        super().__init__(view)
+        self.view = view
+        self.avatars = {USER: user_avatar, ROBOT: robot_avatar}
+        self.font = QFont('Lucida Console')
+        self.font.setPixelSize(20)
+        self.metrics = QFontMetrics(self.font)
+        # 行号 -> (排版宽度, 气泡大小)，宽度没变时不用重新测量文字
+        self.sizes = {}
+        self.setTheme(False)
+
+    def setAvatar(self, speaker, pixmap):
+        self.avatars[speaker] = pixmap
+
+    def setTheme(self, light):
+        # 和 light_custom.css / dark_custom.css 里 QLabel 的样式一致
+        self.background = QColor('white' if light else 'black')
+        self.color = QColor('pink')
+
+    def forgetSizes(self, topLeft, bottomRight):
+        # 气泡内容变了，丢掉缓存的大小
+        for row in range(topLeft.row(), bottomRight.row() + 1):
+            self.sizes.pop(row, None)
+
+    def bubbleSize(self, index):
+        pixmap = index.data(ChatModel.PixmapRole)
+        if pixmap is not None:
+            return pixmap.size()
+        # 气泡最宽不超过去掉两边头像后的宽度，超出部分自动换行
+        max_width = max(self.view.viewport().width() - 2 * (AVATAR_SIZE + 15) - 2 * BUBBLE_PADDING, 50)
+        cached = self.sizes.get(index.row())
+        if cached is not None and cached[0] == max_width:
+            return cached[1]
+        rect = self.metrics.boundingRect(QRect(0, 0, max_width, 0), Qt.AlignCenter | Qt.TextWordWrap,
+                                         index.data(Qt.DisplayRole))
+        size = QSize(rect.width() + 2 * BUBBLE_PADDING, rect.height() + 2 * BUBBLE_PADDING)
+        self.sizes[index.row()] = (max_width, size)
+        return size
+
+    def sizeHint(self, option, index):
+        size = self.bubbleSize(index)
+        return QSize(self.view.viewport().width(), max(size.height(), AVATAR_SIZE) + SPACING)
+
+    def paint(self, painter, option, index):
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        speaker = index.data(ChatModel.SpeakerRole)
+        size = self.bubbleSize(index)
+        rect = option.rect
+        top = rect.top() + SPACING // 2
+        if speaker == USER:
+            painter.drawPixmap(rect.right() - 45, top, self.avatars[USER])
+            bubble = QRect(rect.right() - 50 - size.width(), top, size.width(), size.height())
+        else:
+            painter.drawPixmap(rect.left(), top, self.avatars[ROBOT])
+            bubble = QRect(rect.left() + 40, top, size.width(), size.height())
+
+        pixmap = index.data(ChatModel.PixmapRole)
+        if pixmap is not None:
+            painter.drawPixmap(bubble.topLeft(), pixmap)
+        else:
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(self.background)
+            painter.drawRoundedRect(bubble, 10, 10)
+            painter.setPen(self.color)
+            painter.setFont(self.font)
+            painter.drawText(bubble.adjusted(BUBBLE_PADDING, BUBBLE_PADDING, -BUBBLE_PADDING, -BUBBLE_PADDING),
+                             Qt.AlignCenter | Qt.TextWordWrap, index.data(Qt.DisplayRole))
+        painter.restore()
+
+
+class ChatView(QListView):
+    # 只读的聊天记录列表，按像素滚动，宽度变化时重新排版
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setResizeMode(QListView.Adjust)
+        # 分批排版：先排可见的部分，其余的在空闲时继续，长对话改变窗口大小也不会卡住
+        self.setLayoutMode(QListView.Batched)
+        self.setBatchSize(50)
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setFocusPolicy(Qt.NoFocus)
+        # 停在底部时，新消息排版完成后自动跟随到底部；用户往上翻的时候不打扰
+        self.follow_bottom = True
+        self.verticalScrollBar().valueChanged.connect(self.onScrolled)
+        self.verticalScrollBar().rangeChanged.connect(self.onRangeChanged)
+
+    def onScrolled(self, value):
+        self.follow_bottom = value == self.verticalScrollBar().maximum()
+
+    def onRangeChanged(self, minimum, maximum):
+        if self.follow_bottom:
+            self.verticalScrollBar().setValue(maximum)
+
+    def scrollToBottom(self):
+        self.follow_bottom = True
+        super().scrollToBottom()
+
+
+# (路径, 大小) -> (文件的修改时间, 缩放好的头像)，同一张图片只解码、缩放一次
+# 同一路径的文件被替换后修改时间会变，下次调用时重新加载
+avatar_cache = {}
+
+
+def loadAvatar(path, size=AVATAR_SIZE):
+    # 所有气泡引用同一个 QPixmap，换头像时只需要解码一次再重绘可见的行
+    key = (path, size)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        avatar_cache.pop(key, None)
+        return QPixmap()
+    cached = avatar_cache.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    Image = QPixmap()
+    if not Image.load(path):
+        return Image
+    Image = Image.scaled(size, size)
+    avatar_cache[key] = (mtime, Image)
+    return Image
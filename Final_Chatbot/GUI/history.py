@@ -1,16 +1,64 @@
 import sys
 import os
+import html
+import traceback
 from PyQt5 import QtCore, QtGui, QtWidgets
-from PyQt5.QtCore import Qt, QFile, QTextStream, QIODevice, QByteArray
+from PyQt5.QtCore import (Qt, QFile, QTextStream, QIODevice, QByteArray, QObject, QRunnable,
+                          QThreadPool, QTimer, pyqtSignal)
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QMessageBox,
                              QAction, QFileDialog, QSplitter,
                              QTextEdit)
 from PyQt5.QtGui import QTextCursor, QTextCharFormat, QFont
+from GUI.history_writer import read_records, format_records
+from GUI.history_index import HistoryIndex, PAGE_SIZE
+from GUI.history_archive import ARCHIVE_SUFFIX, read_archive, split_member
+
+HISTORY_DIR = r'C:\Users\86138\Desktop\Chatbot\History'
+
+
+class SearchSignals(QObject):
+    # (第几次搜索, 结果总数, 这一页的结果)
+    page = pyqtSignal(int, int, object)
+
+
+class SearchWorker(QRunnable):
+    # 在线程池里查一页搜索结果，片段和高亮位置也在这里算好，GUI 线程只负责插入
+    # total 为 None 时是第一页：先 sync 索引再统计总数
+    def __init__(self, index, generation, key, page, total=None):
+        super().__init__()
+        self.index = index
+        self.generation = generation
+        self.key = key
+        self.page = page
+        self.total = total
+        self.signals = SearchSignals()
+
+    def run(self):
+        try:
+            total = self.total
+            if total is None:
+                self.index.sync()
+                total = self.index.count(self.key)
+            hits = self.index.search(self.key, self.page) if total else []
+        except Exception:
+            # 出错也要发信号，否则界面会一直停在 "Searching..."
+            traceback.print_exc()
+            total, hits = 0, []
+        self.signals.page.emit(self.generation, total, hits)
 
 
 class HistoryUI(QtWidgets.QWidget):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, index=None):
         super().__init__(parent)
+        # 聊天记录的全文索引，主窗口会把 HistoryWriter 用的那个传进来
+        self.index = index if index is not None else HistoryIndex(HISTORY_DIR)
+        self.key = ''
+        self.page = 0
+        self.total = 0
+        # 每次新的搜索加一，旧搜索晚到的结果直接丢掉
+        self.generation = 0
+        self.loading = False
+        self.search_pool = QThreadPool.globalInstance()
 
         # 设置窗口标题
         # self.resize(800, 800)
@@ -40,10 +88,18 @@ class HistoryUI(QtWidgets.QWidget):
         # self.output_widget.setLayout(self.output_layout)
         self.output_widget_show = QtWidgets.QTextEdit(self)
         self.output_widget_show.setReadOnly(True)
+        self.output_widget_show.setUndoRedoEnabled(False)
+        # 滚到底部时自动加载下一页
+        self.output_widget_show.verticalScrollBar().valueChanged.connect(self.onScrolled)
+
+        self.more_button = QtWidgets.QPushButton("More", self)  # 下一页搜索结果
+        self.more_button.hide()
+        self.more_button.clicked.connect(self.onMore)
 
         self.input_widget_input.setGeometry(50, 50, 550, 50)
         self.input_button.setGeometry(625, 50, 125, 50)
         self.output_widget_show.setGeometry(50, 125, 700, 600)
+        self.more_button.setGeometry(625, 740, 125, 40)
 
 
 
@@ -88,6 +144,16 @@ class HistoryUI(QtWidgets.QWidget):
         menuExit.addAction(actionExit)
     '''
 
+    # 窗口大小变化时调整搜索栏和结果区域的大小
+    def resizeEvent(self, e):
+        width = self.rect().width()
+        height = self.rect().height()
+        self.input_widget_input.resize(width - 250, 50)
+        self.input_button.move(width - 175, 50)
+        self.output_widget_show.resize(width - 100, height - 235)
+        self.more_button.move(width - 175, height - 100)
+        super().resizeEvent(e)
+
     def msgCritical(self, strInfo):
         dlg = QMessageBox(self)
         dlg.setIcon(QMessageBox.Critical)
@@ -96,73 +162,74 @@ class HistoryUI(QtWidgets.QWidget):
 
     def onFileSearch(self):
         self.output_widget_show.clear()
-        file_list = []
-        count = 0
-        key = self.input_widget_input.text()
-        cursor = self.output_widget_show.textCursor()
+        self.key = self.input_widget_input.text()
         self.input_widget_input.clear()
-        # print(key)
-        for filepath, dirnames, filenames in os.walk(r'C:\Users\86138\Desktop\Chatbot\History'):
-            for filename in filenames:
-                file_list.append(os.path.join(filepath, filename))
-                # print(os.path.join(filepath, filename))
-        for file in file_list:
-            size = os.path.getsize(file)
-            if size != 0:
-                f = open(file)
-                if key in f.read():
-                    f.close()
-                    f = open(file)
-                    temp = "chat history" + str(count) + "------" + file
-                    temp = temp.strip('\n')
-                    self.output_widget_show.append(temp)
-                    # 光标移到结尾
-                    cursor.movePosition(QTextCursor.End)
-                    self.output_widget_show.setTextCursor(cursor)
-                    # 选择当前行
-                    cursor.select(QTextCursor.LineUnderCursor)
-                    if cursor.block().text() == temp:
-                        # 格式
-                        format1 = QTextCharFormat()
-                        format1.setFontWeight(QFont.Bold)
-                        format1.setFontPointSize(9)
-                        cursor.mergeCharFormat(format1)
-                        cursor.clearSelection()
-                        # 重回文本开头
-                        cursor.movePosition(QTextCursor.Start)
-                        self.output_widget_show.setTextCursor(cursor)
-
-                    for line in f:
-                        line = line.strip('\n')
-                        # 去掉结尾的换行符，否则下方的光标无法选择文本
-                        self.output_widget_show.append(line)
-                        if key in line:
-                            # 光标移到结尾
-                            cursor.movePosition(QTextCursor.End)
-                            self.output_widget_show.setTextCursor(cursor)
-                            # 选择当前行
-                            cursor.select(QTextCursor.LineUnderCursor)
-                            # 格式
-                            format2 = QTextCharFormat()
-                            format2.setBackground(QtGui.QBrush(QtGui.QColor("grey")))
-                            cursor.mergeCharFormat(format2)
-                            cursor.clearSelection()
-                            # 重回文本开头
-                            cursor.movePosition(QTextCursor.Start)
-                            self.output_widget_show.setTextCursor(cursor)
-
-                    count += 1
-                    self.output_widget_show.append('\n')
-                    self.output_widget_show.append('\n')
-                    f.close()  # 关闭文件
-                else:
-                    # print("no")
-                    f.close()
-        if count == 0:
-            self.output_widget_show.append("Not found.")
+        self.generation += 1
+        self.page = 0
+        self.total = 0
+        self.more_button.hide()
+        if not self.key:
+            self.loading = False
+            return
+        self.output_widget_show.setPlainText("Searching...")
+        self.startSearch(None)
+
+    def onMore(self):
+        if self.loading or not self.hasMore():
+            return
+        self.page += 1
+        self.startSearch(self.total)
+
+    def onScrolled(self, value):
+        if value >= self.output_widget_show.verticalScrollBar().maximum() - 20:
+            self.onMore()
+
+    def hasMore(self):
+        return (self.page + 1) * PAGE_SIZE < self.total
+
+    def startSearch(self, total):
+        self.loading = True
+        worker = SearchWorker(self.index, self.generation, self.key, self.page, total)
+        worker.signals.page.connect(self.onPage)
+        self.search_pool.start(worker)
+
+    def onPage(self, generation, total, hits):
+        if generation != self.generation:
+            return
+        self.loading = False
+        self.total = total
+        if self.page == 0:
+            self.output_widget_show.clear()
+            if total == 0:
+                self.output_widget_show.setPlainText("Not found.")
+                return
+            text = "<b>{} results</b>".format(total)
+        else:
+            text = ''
+        # 一页结果拼成一段 html，一次插入文档
+        text += ''.join('<br><b>{}</b> {}<br>{}: {}<br>'.format(html.escape(displayName(hit["path"])),
+                                                              html.escape(str(hit["time"])),
+                                                              html.escape(hit["speaker"]),
+                                                              highlightHtml(hit["snippet"], hit["ranges"]))
+                        for hit in hits)
+        cursor = QTextCursor(self.output_widget_show.document())
+        cursor.movePosition(QTextCursor.End)
+        cursor.beginEditBlock()
+        cursor.insertHtml(text)
+        cursor.endEditBlock()
+        self.more_button.setVisible(self.hasMore())
+        # 刚插入时文档的布局和滚动条的范围还没更新，等布局完成后再检查要不要接着加载
+        QTimer.singleShot(0, lambda: self.fillViewport(generation))
+
+    def fillViewport(self, generation):
+        # 结果还不够填满窗口、出不了滚动条时，接着加载下一页；窗口没显示时没有布局，不自动加载
+        if generation != self.generation or not self.output_widget_show.isVisible():
+            return
+        if self.output_widget_show.verticalScrollBar().maximum() == 0:
+            self.onMore()
 
     def onFileOpen(self):
-        path, _ = QFileDialog.getOpenFileName(self, '打开文件', r'C:\Users\86138\Desktop\Chatbot\History', '文本文件 (*.txt)')
+        path, _ = QFileDialog.getOpenFileName(self, '打开文件', r'C:\Users\86138\Desktop\Chatbot\History', '聊天记录 (*.jsonl *.txt *.archive)')
         if path:
             f = QFile(path)
             if not f.exists():
@@ -173,13 +240,47 @@ class HistoryUI(QtWidgets.QWidget):
                 return False
             self.path = path
 
+            # 打开文件和搜索共用同一个输出框：丢掉还没返回的搜索页，停止翻页，清空之前的结果
+            self.generation += 1
+            self.page = 0
+            self.total = 0
+            self.loading = False
+            self.more_button.hide()
+            self.output_widget_show.clear()
+
             self.show()
-            while not f.atEnd():
-                line = QByteArray(f.readLine())
-                linebytes = bytes(line)
-                linestr = linebytes.decode("utf-8")
-                self.output_widget_show.append(linestr)
-            f.close()  # 关闭文件
+            lines = []
+            if path.endswith(ARCHIVE_SUFFIX):
+                # 月度归档：按天解压，当成一个文件显示
+                f.close()
+                for name, data in read_archive(path):
+                    lines.extend(data.decode('utf-8', errors='replace').splitlines())
+            else:
+                while not f.atEnd():
+                    line = QByteArray(f.readLine())
+                    linebytes = bytes(line)
+                    lines.append(linebytes.decode("utf-8"))
+                f.close()  # 关闭文件
+            for line in format_records(read_records(lines)):
+                self.output_widget_show.append(line)
+
+
+def displayName(path):
+    # 归档里的某一天显示原来的文件名
+    archive, name = split_member(path)
+    return name if name is not None else os.path.basename(path)
+
+
+def highlightHtml(snippet, ranges):
+    # 片段转成 html，匹配的部分加上灰色背景
+    parts = []
+    last = 0
+    for start, length in ranges:
+        parts.append(html.escape(snippet[last:start]))
+        parts.append('<span style="background-color: grey">' + html.escape(snippet[start:start + length]) + '</span>')
+        last = start + length
+    parts.append(html.escape(snippet[last:]))
+    return ''.join(parts)
 
 
 if __name__ == '__main__':
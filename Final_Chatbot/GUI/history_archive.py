@@ -0,0 +1,168 @@
+# 聊天记录的压缩归档
+# 超过 keep_days 天的每日文件合并进所在月份的归档 History/<年>/<月>/timeFile_<年>_<月>.archive，
+# 每一天是一个独立的 gzip 块（整个文件也仍然是合法的 gzip），块的位置记在旁边的 .archive.idx 里，
+# 读某一天只需要 seek 过去解压这一块。retention_days 之前的记录直接删除。
+# 用法：在 Final_Chatbot 目录下运行 python -m GUI.history_archive [History 目录] [keep_days] [retention_days]
+import datetime
+import gzip
+import json
+import os
+import re
+import sys
+
+ARCHIVE_SUFFIX = '.archive'
+INDEX_SUFFIX = '.idx'
+# 索引里归档中某一天的路径写成 <归档路径>#<原文件名>
+MEMBER_SEP = '#'
+DAY_FILE = re.compile(r'^timeFile_(\d{4})_(\d{2})_(\d{2})\.(jsonl|txt)$')
+
+
+def archive_file(root, year, month):
+    return os.path.join(root, year, month, 'timeFile_' + year + '_' + month + ARCHIVE_SUFFIX)
+
+
+def member_path(archive, name):
+    return archive + MEMBER_SEP + name
+
+
+def split_member(path):
+    # 归档成员返回 (归档路径, 文件名)，普通文件返回 (path, None)
+    if MEMBER_SEP in os.path.basename(path):
+        archive, name = path.rsplit(MEMBER_SEP, 1)
+        return archive, name
+    return path, None
+
+
+def read_blocks(archive):
+    # 读块索引：[{"name", "offset", "length", "size"}, ...]
+    try:
+        with open(archive + INDEX_SUFFIX, 'r') as f:
+            return json.load(f)["blocks"]
+    except (OSError, ValueError):
+        return []
+
+
+def read_member(archive, name):
+    # 只解压一天的数据
+    for block in read_blocks(archive):
+        if block["name"] == name:
+            with open(archive, 'rb') as f:
+                f.seek(block["offset"])
+                return gzip.decompress(f.read(block["length"]))
+    raise FileNotFoundError(member_path(archive, name))
+
+
+def read_archive(archive):
+    # 按天的顺序返回 [(文件名, 数据), ...]
+    with open(archive, 'rb') as f:
+        members = []
+        for block in read_blocks(archive):
+            f.seek(block["offset"])
+            members.append((block["name"], gzip.decompress(f.read(block["length"]))))
+    return members
+
+
+def append_members(archive, paths):
+    # 把几个每日文件作为新的块追加到归档末尾，写完数据再替换块索引
+    # 返回 {每日文件: 它在归档里的名字}
+    blocks = read_blocks(archive)
+    names = {block["name"]: block["size"] for block in blocks}
+    members = {}
+    with open(archive, 'ab') as f:
+        # 上次追加到一半就中断的话，没进索引的数据会被截掉
+        f.truncate(blocks[-1]["offset"] + blocks[-1]["length"] if blocks else 0)
+        f.seek(0, os.SEEK_END)
+        for path in paths:
+            name = os.path.basename(path)
+            with open(path, 'rb') as day:
+                data = day.read()
+            members[path] = name
+            if names.get(name) == len(data):
+                # 上次已经归档、只是还没来得及删除的文件
+                continue
+            # 同名的一天又出现了（比如系统时间被改过），换个名字另存一块，不覆盖也不丢
+            n = 1
+            while name in names:
+                name = os.path.basename(path) + '.' + str(n)
+                n += 1
+            names[name] = len(data)
+            members[path] = name
+            block = gzip.compress(data)
+            blocks.append({"name": name, "offset": f.tell(), "length": len(block), "size": len(data)})
+            f.write(block)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp = archive + INDEX_SUFFIX + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({"blocks": blocks}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, archive + INDEX_SUFFIX)
+    return members
+
+
+def compact(root, keep_days=30, retention_days=None, index=None, today=None):
+    # keep_days 天以内的文件不动（今天的文件还在被 HistoryWriter 写）
+    # 传入 HistoryIndex 时，归档后的记录直接改路径，不用重新建索引
+    keep_days = max(keep_days, 1)
+    if today is None:
+        today = datetime.date.today()
+    archive_before = today - datetime.timedelta(days=keep_days)
+    delete_before = None if retention_days is None else today - datetime.timedelta(days=retention_days)
+
+    months = {}
+    for filepath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(filepath, filename)
+            if filename.endswith(ARCHIVE_SUFFIX):
+                if delete_before is not None:
+                    match = re.match(r'^timeFile_(\d{4})_(\d{2})' + re.escape(ARCHIVE_SUFFIX) + '$', filename)
+                    # 整个月都早于保留期限才删除归档
+                    if match and next_month(int(match.group(1)), int(match.group(2))) <= delete_before:
+                        remove_archive(path, index)
+                continue
+            match = DAY_FILE.match(filename)
+            if match is None:
+                continue
+            day = datetime.date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+            if delete_before is not None and day < delete_before:
+                remove(path, index)
+            elif day < archive_before:
+                months.setdefault(archive_file(root, match.group(1), match.group(2)), []).append(path)
+
+    for archive, paths in months.items():
+        paths.sort()
+        members = append_members(archive, paths)
+        # 归档写好之后才删除原来的每日文件
+        for path in paths:
+            if index is not None:
+                index.move(path, member_path(archive, members[path]))
+            os.remove(path)
+    return sorted(months)
+
+
+def next_month(year, month):
+    return datetime.date(year + month // 12, month % 12 + 1, 1)
+
+
+def remove(path, index):
+    if index is not None:
+        index.forget(path)
+    os.remove(path)
+
+
+def remove_archive(archive, index):
+    if index is not None:
+        for block in read_blocks(archive):
+            index.forget(member_path(archive, block["name"]))
+    os.remove(archive)
+    if os.path.exists(archive + INDEX_SUFFIX):
+        os.remove(archive + INDEX_SUFFIX)
+
+
+if __name__ == '__main__':
+    root = sys.argv[1] if len(sys.argv) > 1 else r'C:\Users\86138\Desktop\Chatbot\History'
+    keep_days = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    retention_days = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    for archive in compact(root, keep_days, retention_days):
+        print("Compacted into {} ({:.1f} KB)".format(archive, os.path.getsize(archive) / 2 ** 10))
@@ -0,0 +1,171 @@
+# 聊天记录的全文索引
+# 用 SQLite FTS5 保存每条记录，搜索不再遍历、重复读取整个 History 目录
+# files 表记下每个历史文件已经索引到的字节位置，.jsonl 追加的内容只需要增量索引
+# HistoryWriter 每次提交后调用 update()，其它途径产生的文件（旧的 .txt、月度归档等）在 sync() 时补上
+import os
+import sqlite3
+import threading
+
+from GUI.history_writer import read_records
+from GUI.history_archive import ARCHIVE_SUFFIX, read_blocks, read_member, member_path, split_member
+
+INDEX_FILE = 'index.sqlite3'
+PAGE_SIZE = 20
+SNIPPET_WIDTH = 60
+
+
+class HistoryIndex:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, INDEX_FILE)
+        # sqlite 连接不能跨线程使用，写入线程和 GUI 线程各用各的
+        self.local = threading.local()
+        self.lock = threading.RLock()
+        db = self.db()
+        db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, offset INTEGER, mtime REAL)')
+        try:
+            # trigram 分词可以做任意子串匹配，和原来的 key in line 一样，中文也能搜
+            db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS records USING fts5("
+                       "text, speaker UNINDEXED, time UNINDEXED, path UNINDEXED, tokenize='trigram')")
+            self.trigram = True
+        except sqlite3.OperationalError:
+            # SQLite 3.34 之前没有 trigram，退回按词索引，子串搜索走 LIKE
+            db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS records USING fts5("
+                       "text, speaker UNINDEXED, time UNINDEXED, path UNINDEXED)")
+            self.trigram = False
+        db.commit()
+
+    def db(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            # WAL：写入线程提交的时候搜索照样可以读
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+        return db
+
+    def sync(self):
+        # 把目录里新增或变化的历史文件补进索引，只需要 stat 每个文件
+        for filepath, dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(filepath, filename)
+                if filename.endswith(ARCHIVE_SUFFIX):
+                    for block in read_blocks(path):
+                        self.update(member_path(path, block["name"]))
+                elif filename.endswith('.jsonl') or filename.endswith('.txt'):
+                    self.update(path)
+        # 已经删除或者被归档的文件，去掉它们的记录
+        with self.lock:
+            for (path,) in self.db().execute('SELECT path FROM files').fetchall():
+                if not os.path.exists(split_member(path)[0]):
+                    self.forget(path)
+
+    def update(self, path):
+        # 索引 path 里还没有索引过的内容，path 也可以是归档里的某一天
+        with self.lock:
+            db = self.db()
+            archive, name = split_member(path)
+            try:
+                stat = os.stat(archive)
+            except OSError:
+                return
+            row = db.execute('SELECT offset, mtime FROM files WHERE path = ?', (path,)).fetchone()
+            if name is not None:
+                # 归档里的某一天不会再变，索引过一次就够了
+                if row is not None:
+                    return
+                data = read_member(archive, name)
+                offset = len(data)
+            else:
+                if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+                    return
+                offset = 0
+                if row is not None and path.endswith('.jsonl') and stat.st_size >= row[0]:
+                    # .jsonl 只会在末尾追加，从上次的位置接着读
+                    offset = row[0]
+                else:
+                    db.execute('DELETE FROM records WHERE path = ?', (path,))
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    data = f.read()
+                if path.endswith('.jsonl'):
+                    # 最后一行可能还没写完，留到下次
+                    end = data.rfind(b'\n') + 1
+                    data = data[:end]
+                    offset += end
+                else:
+                    offset = stat.st_size
+            records = read_records(data.decode('utf-8', errors='replace').splitlines())
+            db.executemany('INSERT INTO records (text, speaker, time, path) VALUES (?, ?, ?, ?)',
+                           [(record["text"], record["speaker"], record["time"], path) for record in records])
+            db.execute('INSERT OR REPLACE INTO files (path, offset, mtime) VALUES (?, ?, ?)',
+                       (path, offset, stat.st_mtime))
+            db.commit()
+
+    def move(self, old, new):
+        # 每日文件被归档：记录原样保留，只改路径
+        with self.lock:
+            db = self.db()
+            row = db.execute('SELECT offset FROM files WHERE path = ?', (old,)).fetchone()
+            indexed = db.execute('SELECT 1 FROM files WHERE path = ?', (new,)).fetchone()
+            if row is None or indexed is not None or row[0] != os.path.getsize(old):
+                # 没有完整索引过，或者归档里的这一天已经索引了，交给 sync 处理
+                self.forget(old)
+                return
+            db.execute('UPDATE records SET path = ? WHERE path = ?', (new, old))
+            db.execute('UPDATE files SET path = ? WHERE path = ?', (new, old))
+            db.commit()
+
+    def forget(self, path):
+        with self.lock:
+            db = self.db()
+            db.execute('DELETE FROM records WHERE path = ?', (path,))
+            db.execute('DELETE FROM files WHERE path = ?', (path,))
+            db.commit()
+
+    def where(self, key):
+        if self.trigram and len(key) >= 3:
+            # 整个关键字作为一个短语，双引号转义
+            return 'records MATCH ?', '"' + key.replace('"', '""') + '"'
+        return "text LIKE ? ESCAPE '\\'", '%' + key.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+    def count(self, key):
+        where, arg = self.where(key)
+        return self.db().execute('SELECT count(*) FROM records WHERE ' + where, (arg,)).fetchone()[0]
+
+    def search(self, key, page=0, page_size=PAGE_SIZE):
+        # 按时间从新到旧返回第 page 页的结果，每条带上高亮好的片段
+        where, arg = self.where(key)
+        rows = self.db().execute(
+            'SELECT time, speaker, text, path FROM records WHERE ' + where +
+            ' ORDER BY time DESC, rowid DESC LIMIT ? OFFSET ?', (arg, page_size, page * page_size)).fetchall()
+        hits = []
+        for t, speaker, text, path in rows:
+            snippet, ranges = highlight(text, key)
+            hits.append({"time": t, "speaker": speaker, "text": text, "path": path,
+                         "snippet": snippet, "ranges": ranges})
+        return hits
+
+
+def highlight(text, key, width=SNIPPET_WIDTH):
+    # 截取第一个匹配前后 width 个字符作为片段，返回 (片段, [(开始, 长度), ...])
+    # 和搜索一样不区分大小写
+    lower = text.lower()
+    key = key.lower()
+    if len(lower) != len(text) or not key:
+        lower = text
+    first = lower.find(key)
+    if first < 0:
+        return text[:2 * width], []
+    start = max(first - width, 0)
+    end = min(first + len(key) + width, len(text))
+    prefix = '...' if start > 0 else ''
+    suffix = '...' if end < len(text) else ''
+    ranges = []
+    i = first
+    while 0 <= i and i + len(key) <= end:
+        ranges.append((len(prefix) + i - start, len(key)))
+        i = lower.find(key, i + len(key))
+    return prefix + text[start:end] + suffix, ranges
@@ -0,0 +1,168 @@
+# 聊天记录的写入服务
+# 发送消息时只把记录放进队列，后台线程攒够一批或者到时间后一次写入（group commit），
+# 文件句柄一直保持打开，GUI 线程不再因为每条消息打开/关闭文件而卡顿。
+# 记录是结构化的 JSON Lines：每行一条 {time, speaker, text, tag, confidence, latency}，
+# 每次提交后 flush + fsync，崩溃时最多丢掉最后一行没写完的记录，读取时会跳过它。
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def day_file(root, t):
+    # History/<年>/<月>/timeFile_<年>_<月>_<日>.jsonl
+    year = time.strftime('%Y', t)
+    month = time.strftime('%m', t)
+    day = time.strftime('%d', t)
+    return os.path.join(root, year, month, 'timeFile_' + year + '_' + month + '_' + day + '.jsonl')
+
+
+class HistoryWriter:
+    def __init__(self, root, flush_interval=1.0, batch_size=32, index=None):
+        self.root = root
+        # 可选的 HistoryIndex，每次提交后增量更新
+        self.index = index
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.path = None
+        self.file = None
+        # close() 之后后台线程不再读队列，之后的 write() 直接同步写入
+        self.closed = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name='HistoryWriter', daemon=True)
+        self.thread.start()
+
+    def write(self, speaker, text, tag=None, confidence=None, latency=None, t=None):
+        # 只入队，不做任何 I/O，可以在 GUI 线程里直接调用
+        if t is None:
+            t = time.localtime(time.time())
+        record = {
+            "time": time.strftime(TIME_FORMAT, t),
+            "speaker": speaker,
+            "text": text,
+            "tag": tag,
+            "confidence": confidence,
+            "latency": latency
+        }
+        with self.lock:
+            if not self.closed:
+                self.queue.put(record)
+                return
+        # 窗口关闭时还在生成的回复：等后台线程写完剩下的记录，再自己写这一条，不会丢
+        self.thread.join()
+        with self.lock:
+            self.commit([record])
+            self.release()
+
+    def close(self):
+        # 写完队列里剩下的记录再退出
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                record = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                record = False
+            if record:
+                batch.append(record)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if batch and (record is None or record is False or len(batch) >= self.batch_size):
+                self.commit(batch)
+                batch = []
+                deadline = None
+            if record is None:
+                self.release()
+                return
+
+    def commit(self, batch):
+        # 一批记录按日期写到对应的文件里，每个文件写完后 flush + fsync
+        groups = {}
+        for record in batch:
+            t = time.strptime(record["time"], TIME_FORMAT)
+            groups.setdefault(day_file(self.root, t), []).append(record)
+        for path, records in groups.items():
+            try:
+                f = self.open(path)
+                f.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+                f.flush()
+                os.fsync(f.fileno())
+            except OSError as e:
+                print("HistoryWriter: failed to write {}: {}".format(path, e))
+                continue
+            if self.index is not None:
+                try:
+                    self.index.update(path)
+                except Exception as e:
+                    print("HistoryWriter: failed to index {}: {}".format(path, e))
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = None
+        self.path = None
+
+    def open(self, path):
+        # 日期变了才换文件，其余时间一直用同一个句柄
+        if path != self.path:
+            if self.file is not None:
+                self.file.close()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.file = open(path, 'a', encoding='utf-8')
+            self.path = path
+        return self.file
+
+
+TIME_LINE = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$')
+
+
+def read_records(lines):
+    # 从一个历史文件的所有行里读出记录
+    # 同时支持新的 .jsonl 格式和旧的 "时间 / User: / Robot:" 文本格式
+    records = []
+    t = None
+    for line in lines:
+        line = line.rstrip('\n')
+        if line.startswith('{'):
+            try:
+                records.append(json.loads(line))
+                continue
+            except ValueError:
+                # 崩溃时没写完的最后一行，或者旧格式里恰好以 { 开头的消息
+                pass
+        if TIME_LINE.match(line):
+            t = line
+        elif line.startswith('User: ') or line.startswith('Robot: '):
+            speaker, text = line.split(': ', 1)
+            records.append({"time": t, "speaker": speaker, "text": text,
+                            "tag": None, "confidence": None, "latency": None})
+        elif records and records[-1]["time"] == t and line != '':
+            # 多行消息的后续行
+            records[-1]["text"] += '\n' + line
+    return records
+
+
+def format_records(records):
+    # 按原来的文本格式显示：时间、User、Robot，然后空一行
+    lines = []
+    for record in records:
+        if record["speaker"] == 'User':
+            if lines:
+                lines.append('')
+            lines.append(str(record["time"]))
+        lines.append(record["speaker"] + ': ' + record["text"])
+    return lines
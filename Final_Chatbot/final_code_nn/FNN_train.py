@@ -4,34 +4,44 @@ import torch.nn as nn
 import numpy
 import nltk
 import json
-from torch.utils.data import Dataset, DataLoader
-
-
-class ChatNN(nn.Module):
-    # 需要自己写初始化和forward函数
-    def __init__(self, input_size, hidden_size, output_size):
-        super(ChatNN, self).__init__()   # 默认要加这一行，调用父类的初始化操作
-        self.linear0 = nn.Linear(input_size, hidden_size)
-        self.linear1 = nn.Linear(hidden_size, hidden_size)
-        self.linear2 = nn.Linear(hidden_size, output_size)
-        self.relu = nn.ReLU()
-
-    def forward(self, input_x):
-        # 拼写检查要注意
-        output_mid = self.linear0(input_x)
-        output_mid = self.relu(output_mid)
-        output_mid = self.linear1(output_mid)
-        output_mid = self.relu(output_mid)
-        output_mid = self.linear1(output_mid)
-        output_mid = self.relu(output_mid)
-        output_mid = self.linear1(output_mid)
-        output_mid = self.relu(output_mid)
-        output_final = self.linear2(output_mid)
-        return output_final
+import os
+from train_cache import cache_file, load_cache, save_cache
+from models import ChatNN
+
+
+# 标点和不文明单词，分词时去掉
+SKIP_WORDS = {',', ';', ':', '!', '?', '.'}
+DIRTY_WORDS = {'fuck', 'bitch', 'sb'}
+
+# 词性 -> 权重，没有列出的词性权重为 2
+# 原来的 if/elif 把形容词写成了 'JJ"'，普通形容词 JJ 一直按默认权重 2 处理，这里保持不变
+POS_WEIGHT = {
+    'CD': 3,                                            # 数词
+    'JJR': 4, 'JJS': 4,                                 # 形容词
+    'NN': 4, 'NNS': 4,                                  # 名词
+    'RB': 3, 'RBR': 3, 'RBS': 3,                        # 副词
+    'VB': 6, 'VBD': 6, 'VBG': 6, 'VBN': 6, 'VBP': 6, 'VBZ': 6,
+    'WDT': 3, 'WP': 3, 'WP$': 3, 'WRB': 3,              # 特殊疑问词
+    'CC': 1,                                            # 连词
+    'DT': 1,                                            # 限定词
+    'IN': 1,                                            # 介词
+    'RP': 1                                             # 虚词
+}
 
+# 预处理的结果按 traindata.json 的内容和下面的配置做哈希缓存，只改超参数时不用再跑 nltk
+# 修改 trans_to_words / cal_weight / build_dataset 的逻辑时要把 version 加一
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'preprocess_cache')
+PREPROCESS_CONFIG = {
+    "version": 1,
+    "skip_words": sorted(SKIP_WORDS),
+    "dirty_words": sorted(DIRTY_WORDS),
+    "pos_weight": POS_WEIGHT,
+    "nltk": nltk.__version__
+}
 
-with open('traindata.json', 'r') as f:
-    TrainArray = json.load(f)
+with open('traindata.json', 'rb') as f:
+    TrainBytes = f.read()
+TrainArray = json.loads(TrainBytes)
 
 
 def trans_to_words(sen):
@@ -43,10 +53,10 @@ def trans_to_words(sen):
     # print(word_array)
     for s_word in word_array:
         s_word = s_word.lower()
-        if s_word == ',' or s_word == ';' or s_word == ':' or s_word == '!' or s_word == '?' or s_word == '.':
+        if s_word in SKIP_WORDS:
             # 无需考虑 ，但是要考虑 .?!
             continue
-        if s_word == 'fuck' or s_word == 'bitch' or s_word == 'sb':
+        if s_word in DIRTY_WORDS:
             # 处理 dirty words
             continue
         words_tmp.append(s_word)
@@ -54,117 +64,111 @@ def trans_to_words(sen):
     return words_tmp
 
 
-tags = []
-words = []
-sentence_tag = []  # 句子与标签的一一对应，是个元组的数组，但是其中的句子实际上是单词数组
-train_input = []
-train_output = []
-words_weight = []     # 根据词性给不同的单词设置权重
-
-for i in TrainArray['traindata']:
-    tag = i['tag']
-    tags.append(tag)
-    for input_sentence in i['input_sen']:
-        # print(input_sentence)
-        tmp = trans_to_words(input_sentence)
-        # print(tmp)
-        words.extend(tmp)
-        sentence_tag.append((tmp, tag))
-
-words = sorted(set(words))
-word_tag = nltk.pos_tag(words)  # 对单词数组进行分词
-
-
 def cal_weight():
     # 根据词性，给与不同的权重
-    for index in range(len(words)):
-        if word_tag[index][1] == 'CD':   # 数词
-            word_weight = 3
-        elif word_tag[index][1] == 'JJ"' or word_tag[index][1] == 'JJR' or word_tag[index][1] == 'JJS':  # 形容词
-            word_weight = 4
-        elif word_tag[index][1] == 'NN' or word_tag[index][1] == 'NNS':  # 名词
-            word_weight = 4
-        elif word_tag[index][1] == 'RB' or word_tag[index][1] == 'RBR' or word_tag[index][1] == 'RBS':   # 副词
-            word_weight = 3
-        elif word_tag[index][1] == 'VB' or word_tag[index][1] == 'VBD' or word_tag[index][1] == 'VBG' or word_tag[index][1] == 'VBN' or word_tag[index][1] == 'VBP' or word_tag[index][1] == 'VBZ':
-            word_weight = 6
-        elif word_tag[index][1] == 'WDT' or word_tag[index][1] == 'WP' or word_tag[index][1] == 'WP$' or word_tag[index][1] == 'WRB':  # 特殊疑问词
-            word_weight = 3
-        elif word_tag[index][1] == 'CC':  # 连词
-            word_weight = 1
-        elif word_tag[index][1] == 'DT':  # 限定词
-            word_weight = 1
-        elif word_tag[index][1] == 'IN':  # 介词
-            word_weight = 1
-        elif word_tag[index][1] == 'RP':  # 虚词
-            word_weight = 1
-        else:
-            word_weight = 2
-
-        words_weight.append(word_weight)
-
-
-cal_weight()
-
-
-def trans_to_num(sen):
-    # 这里的sentence已经是处理后的单词数组
-    num_tmp = numpy.zeros(shape=len(words), dtype=numpy.float32)
-    # numpy的数据格式有严格要求，此处先初始化
-    for index in range(len(words)):
-        if words[index] in sen:
-            num_tmp[index] = words_weight[index]
-    return num_tmp
-
-
-# 将输入输出转换为数字
-for (sentence, tag) in sentence_tag:
-    # 这里的sentence实际上已经是处理后得到的单词数组
-    sen_num = trans_to_num(sentence)
-    train_input.append(sen_num)
-    tag_num = tags.index(tag)
-    train_output.append(tag_num)
-
-train_input = numpy.array(train_input)
-train_output = numpy.array(train_output)
+    for word, pos in word_tag:
+        words_weight.append(POS_WEIGHT.get(pos, 2))
+
+
+def build_dataset():
+    # 所有句子一次性转换为数字：先收集每个句子出现的 (行, 列)，再一次散布到预先分配的矩阵里
+    rows = []
+    cols = []
+    for row, (sentence, tag) in enumerate(sentence_tag):
+        # 这里的sentence实际上已经是处理后得到的单词数组，同一个单词只算一次
+        sen_cols = {word_index[w] for w in sentence}
+        rows.extend([row] * len(sen_cols))
+        cols.extend(sen_cols)
+    rows = numpy.array(rows, dtype=numpy.int64)
+    cols = numpy.array(cols, dtype=numpy.int64)
+    x = numpy.zeros(shape=(len(sentence_tag), len(words)), dtype=numpy.float32)
+    x[rows, cols] = numpy.asarray(words_weight, dtype=numpy.float32)[cols]
+    y = numpy.array([tag_index[tag] for sentence, tag in sentence_tag], dtype=numpy.int64)
+    return x, y
+
+
+CACHE_FILE = cache_file(CACHE_DIR, TrainBytes, PREPROCESS_CONFIG)
+cache = load_cache(CACHE_FILE, ['train_input', 'train_output'])
+if cache is not None:
+    print("Loaded preprocessed data from", CACHE_FILE)
+    meta, (train_input, train_output) = cache
+    tags, words, words_weight = meta['tags'], meta['words'], meta['words_weight']
+    sentence_tag = [(sentence, tag) for sentence, tag in meta['sentence_tag']]
+else:
+    tags = []
+    words = []
+    sentence_tag = []  # 句子与标签的一一对应，是个元组的数组，但是其中的句子实际上是单词数组
+    words_weight = []     # 根据词性给不同的单词设置权重
+
+    for i in TrainArray['traindata']:
+        tag = i['tag']
+        tags.append(tag)
+        for input_sentence in i['input_sen']:
+            # print(input_sentence)
+            tmp = trans_to_words(input_sentence)
+            # print(tmp)
+            words.extend(tmp)
+            sentence_tag.append((tmp, tag))
+
+    words = sorted(set(words))
+    word_tag = nltk.pos_tag(words)  # 对单词数组进行分词
+
+    cal_weight()
+
+    word_index = {w: index for index, w in enumerate(words)}
+    tag_index = {}
+    for index, tag in enumerate(tags):
+        tag_index.setdefault(tag, index)   # 和 tags.index(tag) 一样取第一次出现的位置
+
+    # 将输入输出转换为数字
+    train_input, train_output = build_dataset()
+    save_cache(CACHE_FILE, {"tags": tags, "words": words, "words_weight": words_weight, "sentence_tag": sentence_tag},
+               {"train_input": train_input, "train_output": train_output})
 
 epoch = 4000
-
-
-class ChatDataset(Dataset):
-    def __init__(self):
-        self.x = train_input
-        self.y = train_output
-        self.num = len(train_input)
-
-    def __getitem__(self, index):
-        return self.x[index], self.y[index]
-
-    def __len__(self):
-        return self.num
-
-
-chatdataset = ChatDataset()
-chatdataloader = DataLoader(dataset=chatdataset, batch_size=8, shuffle=True)
-# 创建dataset
+hidden_size = 16
+learning_rate = 0.001
+batch_size = None       # None 表示整个训练集作为一个 batch；数据集变大后可以改成 256 等
+patience = 200          # 训练集的 loss 连续这么多个 epoch 没有下降就提前停止
+min_delta = 1e-4
 
 device = torch.device('cpu')
 
-chatnn = ChatNN(len(words), 16, len(tags)).to(device)
+# 数据集很小，整个放在内存里，不再经过 DataLoader 一条条取、拼 batch
+# 每个 tag 只有几句话，留出验证集会少掉将近三成的句子，验证集的 loss 也在模型还没学会训练集时就开始上升，
+# 所以全部用来训练，按训练集的 loss 判断何时停止
+train_x = torch.from_numpy(train_input)
+train_y = torch.from_numpy(train_output).to(dtype=torch.long)
+if device.type == 'cuda':
+    train_x = train_x.pin_memory()
+    train_y = train_y.pin_memory()
+train_x = train_x.to(device, non_blocking=True)
+train_y = train_y.to(device, non_blocking=True)
+
+chatnn = ChatNN(len(words), hidden_size, len(tags)).to(device)
 # 实例化一个神经网络的对象
 
 criterion = nn.CrossEntropyLoss()       # 交叉熵
-optimizer = torch.optim.Adam(chatnn.parameters(), lr=0.001)     # 优化器
+optimizer = torch.optim.Adam(chatnn.parameters(), lr=learning_rate)     # 优化器
 
-for cnt in range(epoch):
-    for (sen_tensor, tag) in chatdataloader:
+train_num = len(train_y)
+step = train_num if batch_size is None else batch_size
+best_loss = float('inf')
+best_state = None
+bad_epochs = 0
+# 上一次“明显下降”时的 loss；只有比它低出 min_delta 才重新计数，
+# 更小的下降照样更新 best_state，保证最后留下的是 loss 最低的参数
+patience_loss = float('inf')
 
-        sen_tensor = sen_tensor.to(device)
-        tag = tag.to(dtype=torch.long).to(device)
+for cnt in range(epoch):
+    # 每个 epoch 打乱一次下标，按下标切 batch
+    order = torch.randperm(train_num, device=device)
+    for start in range(0, train_num, step):
+        batch = order[start:start + step]
 
-        results = chatnn(sen_tensor)
+        results = chatnn(train_x[batch])
 
-        loss = criterion(results, tag)
+        loss = criterion(results, train_y[batch])
         # 实际输出与与其输出的差别
 
         optimizer.zero_grad()
@@ -173,15 +177,36 @@ for cnt in range(epoch):
         loss.backward()
         optimizer.step()
 
+    with torch.no_grad():
+        train_loss = criterion(chatnn(train_x), train_y).item()
+    if train_loss < best_loss:
+        best_loss = train_loss
+        best_state = {k: v.clone() for k, v in chatnn.state_dict().items()}
+    if train_loss < patience_loss - min_delta:
+        patience_loss = train_loss
+        bad_epochs = 0
+    else:
+        bad_epochs += 1
+
     if (cnt+1) % 100 == 0:
-        print (f'Epoch [{cnt+1}], Loss: {loss.item():.8f}')
+        print (f'Epoch [{cnt+1}], Loss: {train_loss:.8f}')
+
+    if bad_epochs >= patience:
+        print(f'Early stopping at epoch {cnt+1}, best loss {best_loss:.8f}')
+        break
+
+# 保存训练集 loss 最低时的参数
+chatnn.load_state_dict(best_state)
 
+with torch.no_grad():
+    train_acc = (chatnn(train_x).argmax(dim=1) == train_y).float().mean().item()
+print(f'Train accuracy: {train_acc:.4f}')
 
 
 data = {
     "model_state": chatnn.state_dict(),
     "input_size": len(words),
-    "hidden_size": 16,
+    "hidden_size": hidden_size,
     "output_size": len(tags),
     "words": words,
     "words_weight": words_weight,
@@ -12,6 +12,10 @@ import codecs
 from io import open
 import itertools
 import math
+import queue
+import threading
+import numpy
+from collate import padBatch
 
 
 
@@ -94,6 +98,23 @@ class Attn(nn.Module):
         # Return the softmax normalized probability scores (with added dimension)
         return F.softmax(attn_energies, dim=1).unsqueeze(1)
 
+    def forward_sequence(self, hidden, encoder_outputs):
+        # 一次算出所有时间步的注意力：hidden 是 (max_target_len, batch, hidden)，
+        # encoder_outputs 是 (max_length, batch, hidden)，返回 (batch, max_target_len, max_length)
+        # 和逐步调用 forward 的结果一样
+        encoder_outputs_t = encoder_outputs.permute(1, 2, 0)
+        if self.method == 'dot':
+            attn_energies = torch.bmm(hidden.transpose(0, 1), encoder_outputs_t)
+        elif self.method == 'general':
+            attn_energies = torch.bmm(hidden.transpose(0, 1), self.attn(encoder_outputs).permute(1, 2, 0))
+        elif self.method == 'concat':
+            # attn([h; e]) = W_h h + W_e e + b，两部分分开算再广播相加，不用把 h 和 e 两两拼起来
+            weight_h, weight_e = self.attn.weight.split(self.hidden_size, dim=1)
+            energy = (F.linear(hidden, weight_h).unsqueeze(1) +
+                      F.linear(encoder_outputs, weight_e, self.attn.bias).unsqueeze(0)).tanh()
+            attn_energies = torch.sum(self.v * energy, dim=3).permute(2, 0, 1)
+        return F.softmax(attn_energies, dim=2)
+
 class LuongAttnDecoderRNN(nn.Module):
     def __init__(self, attn_model, embedding, hidden_size, output_size, n_layers=1, dropout=0.1):
         super(LuongAttnDecoderRNN, self).__init__()
@@ -113,7 +134,7 @@ class LuongAttnDecoderRNN(nn.Module):
 
         self.attn = Attn(attn_model, hidden_size)
 
-    def forward(self, input_step, last_hidden, encoder_outputs):
+    def forward(self, input_step, last_hidden, encoder_outputs, return_logits=False):
         embedded = self.embedding(input_step)
         embedded = self.embedding_dropout(embedded)
         rnn_output, hidden = self.gru(embedded, last_hidden)
@@ -124,16 +145,34 @@ class LuongAttnDecoderRNN(nn.Module):
         concat_input = torch.cat((rnn_output, context), 1)
         concat_output = torch.tanh(self.concat(concat_input))
         output = self.out(concat_output)
+        if return_logits:
+            # 训练时直接返回 logits，softmax 和 log 合并到 cross_entropy 里一起算
+            return output, hidden
         output = F.softmax(output, dim=1)
         return output, hidden
 
-def maskNLLLoss(inp, target, mask):
-    nTotal = mask.sum()
+    def forward_sequence(self, input_seq, last_hidden, encoder_outputs):
+        # teacher forcing 时每一步的输入都已知，整个序列一次过 GRU，返回所有时间步的 logits
+        # input_seq 是 (max_target_len, batch)，即 [SOS, y0, ..., y(T-2)]
+        embedded = self.embedding(input_seq)
+        embedded = self.embedding_dropout(embedded)
+        rnn_output, hidden = self.gru(embedded, last_hidden)
+        attn_weights = self.attn.forward_sequence(rnn_output, encoder_outputs)
+        context = attn_weights.bmm(encoder_outputs.transpose(0, 1)).transpose(0, 1)
+        concat_input = torch.cat((rnn_output, context), 2)
+        concat_output = torch.tanh(self.concat(concat_input))
+        output = self.out(concat_output)
+        return output, hidden
 
-    crossEntropy = -torch.log(torch.gather(inp, 1, target.view(-1, 1)).squeeze(1))
-    loss = crossEntropy.masked_select(mask).mean()
-    loss = loss.to(device)
-    return loss, nTotal.item()
+def maskCrossEntropy(logits, target, mask):
+    # 所有时间步一次算完：logits 是 (max_target_len, batch, vocab)
+    # 和原来的 maskNLLLoss 一样，每个时间步在有效的词上取平均，再把各个时间步加起来
+    # 返回 (loss, 所有有效词的 loss 之和, 有效词数)，后两个只用来打印，留在设备上不做同步
+    token_loss = F.cross_entropy(logits.view(-1, logits.size(2)), target.reshape(-1),
+                                 ignore_index=PAD_token, reduction='none').view_as(target)
+    step_totals = mask.sum(dim=1)
+    loss = (token_loss.sum(dim=1) / step_totals).sum()
+    return loss, token_loss.sum().detach(), step_totals.sum()
 
 def train(input_variable, lengths, target_variable, mask, max_target_len, encoder, decoder, embedding,
           encoder_optimizer, decoder_optimizer, batch_size, clip, max_length=MAX_LENGTH):
@@ -146,45 +185,35 @@ def train(input_variable, lengths, target_variable, mask, max_target_len, encode
     mask = mask.to(device)
     lengths = lengths.to("cpu")
 
-    loss = 0
-    print_losses = []
-    n_totals = 0
-
     encoder_outputs, encoder_hidden = encoder(input_variable, lengths)
 
-    decoder_input = torch.LongTensor([[SOS_token for _ in range(batch_size)]])
-    decoder_input = decoder_input.to(device)
+    decoder_input = torch.full((1, batch_size), SOS_token, dtype=torch.long, device=device)
 
     decoder_hidden = encoder_hidden[:decoder.n_layers]
 
     use_teacher_forcing = True if random.random() < teacher_forcing_ratio else False
 
     if use_teacher_forcing:
-        for t in range(max_target_len):
-            decoder_output, decoder_hidden = decoder(
-                decoder_input, decoder_hidden, encoder_outputs
-            )
-            # Teacher forcing: next input is current target
-            decoder_input = target_variable[t].view(1, -1)
-            # Calculate and accumulate loss
-            mask_loss, nTotal = maskNLLLoss(decoder_output, target_variable[t], mask[t])
-            loss += mask_loss
-            print_losses.append(mask_loss.item() * nTotal)
-            n_totals += nTotal
+        # Teacher forcing: next input is current target
+        # 所有时间步的输入就是右移一位的目标序列，整个序列一次算完，不用逐步循环
+        decoder_inputs = torch.cat((decoder_input, target_variable[:max_target_len - 1]), 0)
+        decoder_logits, decoder_hidden = decoder.forward_sequence(decoder_inputs, decoder_hidden, encoder_outputs)
     else:
+        step_logits = []
         for t in range(max_target_len):
             decoder_output, decoder_hidden = decoder(
-                decoder_input, decoder_hidden, encoder_outputs
+                decoder_input, decoder_hidden, encoder_outputs, return_logits=True
             )
             # No teacher forcing: next input is decoder's own current output
+            # 直接用 topk 的结果做下一步输入，留在设备上，不再逐个元素取出来
             _, topi = decoder_output.topk(1)
-            decoder_input = torch.LongTensor([[topi[i][0] for i in range(batch_size)]])
-            decoder_input = decoder_input.to(device)
-            # Calculate and accumulate loss
-            mask_loss, nTotal = maskNLLLoss(decoder_output, target_variable[t], mask[t])
-            loss += mask_loss
-            print_losses.append(mask_loss.item() * nTotal)
-            n_totals += nTotal
+            decoder_input = topi.view(1, -1)
+            step_logits.append(decoder_output)
+        decoder_logits = torch.stack(step_logits)
+
+    # 所有时间步的 loss 一次算完
+    loss, loss_sum, n_totals = maskCrossEntropy(decoder_logits, target_variable[:max_target_len],
+                                                mask[:max_target_len])
 
     # Perform backpropatation
     loss.backward()
@@ -197,7 +226,8 @@ def train(input_variable, lengths, target_variable, mask, max_target_len, encode
     encoder_optimizer.step()
     decoder_optimizer.step()
 
-    return sum(print_losses) / n_totals
+    # 返回还在设备上的平均 loss，由 trainIters 累加，打印时才同步
+    return loss_sum / n_totals
 
 
 
@@ -270,20 +300,14 @@ def binaryMatrix(l, value=PAD_token):
 
 def inputVar(l, voc):
     indexes_batch = [indexesFromSentence(voc, sentence) for sentence in l]
-    lengths = torch.tensor([len(indexes) for indexes in indexes_batch])
-    padList = zeroPadding(indexes_batch)
-    padVar = torch.LongTensor(padList)
+    padVar, lengths, _ = padBatch(indexes_batch)
     return padVar, lengths
 
 # Returns padded target sequence tensor, padding mask, and max target length
 def outputVar(l, voc):
     indexes_batch = [indexesFromSentence(voc, sentence) for sentence in l]
-    max_target_len = max([len(indexes) for indexes in indexes_batch])
-    padList = zeroPadding(indexes_batch)
-    mask = binaryMatrix(padList)
-    mask = torch.BoolTensor(mask)
-    padVar = torch.LongTensor(padList)
-    return padVar, mask, max_target_len
+    padVar, _, mask = padBatch(indexes_batch)
+    return padVar, mask, padVar.size(0)
 
 def batch2TrainData(voc, pair_batch):
     pair_batch.sort(key=lambda x: len(x[0].split(" ")), reverse=True)
@@ -295,11 +319,61 @@ def batch2TrainData(voc, pair_batch):
     output, mask, max_target_len = outputVar(output_batch, voc)
     return inp, lengths, output, mask, max_target_len
 
-def trainIters(model_name, voc, pairs, encoder, decoder, encoder_optimizer, decoder_optimizer, embedding, encoder_n_layers, decoder_n_layers, save_dir, n_iteration, batch_size, print_every, save_every, clip, corpus_name, loadFilename):
+def encodePairs(voc, pairs):
+    # 每个句子对只转换一次下标，之后组 batch 不再拆字符串、查字典
+    inputs = [numpy.array(indexesFromSentence(voc, pair[0]), dtype=numpy.int64) for pair in pairs]
+    targets = [numpy.array(indexesFromSentence(voc, pair[1]), dtype=numpy.int64) for pair in pairs]
+    return inputs, targets
+
+
+def batch2TrainIds(input_batch, output_batch):
+    # 已经是下标数组的句子对组成一个 batch，输入按长度从长到短排好（pack_padded_sequence 需要）
+    order = sorted(range(len(input_batch)), key=lambda i: len(input_batch[i]), reverse=True)
+    inp, lengths, _ = padBatch([input_batch[i] for i in order])
+    output, _, mask = padBatch([output_batch[i] for i in order])
+    return inp, lengths, output, mask, output.size(0)
+
+
+class BucketBatchStream:
+    # 按输入长度分桶，一个 batch 只从同一个桶里取，输入几乎不需要 padding
+    # 后台线程提前准备 prefetch 个 batch，训练循环取 batch 几乎不花时间，内存里也始终只有这几个 batch
+    def __init__(self, inputs, targets, batch_size, n_batches, prefetch=8, seed=None):
+        self.inputs = inputs
+        self.targets = targets
+        self.batch_size = batch_size
+        self.n_batches = n_batches
+        buckets = {}
+        for index, indexes in enumerate(inputs):
+            buckets.setdefault(len(indexes), []).append(index)
+        self.buckets = [numpy.array(bucket) for bucket in buckets.values()]
+        # 桶按大小加权选取，每个句子对被选中的概率和原来的 random.choice(pairs) 一样
+        sizes = numpy.array([len(bucket) for bucket in self.buckets], dtype=numpy.float64)
+        self.bucket_prob = sizes / sizes.sum()
+        self.rng = numpy.random.default_rng(seed)
+        self.queue = queue.Queue(maxsize=prefetch)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            for _ in range(self.n_batches):
+                bucket = self.buckets[self.rng.choice(len(self.buckets), p=self.bucket_prob)]
+                # 和原来一样有放回地随机取句子对
+                batch = bucket[self.rng.integers(len(bucket), size=self.batch_size)]
+                self.queue.put(batch2TrainIds([self.inputs[i] for i in batch], [self.targets[i] for i in batch]))
+        except Exception as e:
+            # 交给训练循环抛出，不然它会一直等下去
+            self.queue.put(e)
+
+    def __iter__(self):
+        for _ in range(self.n_batches):
+            batch = self.queue.get()
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+
 
-    # Load batches for each iteration
-    training_batches = [batch2TrainData(voc, [random.choice(pairs) for _ in range(batch_size)])
-                      for _ in range(n_iteration)]
+def trainIters(model_name, voc, pairs, encoder, decoder, encoder_optimizer, decoder_optimizer, embedding, encoder_n_layers, decoder_n_layers, save_dir, n_iteration, batch_size, print_every, save_every, clip, corpus_name, loadFilename):
 
     # Initializations
     print('Initializing ...')
@@ -308,10 +382,14 @@ def trainIters(model_name, voc, pairs, encoder, decoder, encoder_optimizer, deco
     if loadFilename:
         start_iteration = checkpoint['iteration'] + 1
 
+    # 句子对只编码一次，batch 由后台线程按需生成，不再一次性准备 n_iteration 个
+    inputs, targets = encodePairs(voc, pairs)
+    training_batches = iter(BucketBatchStream(inputs, targets, batch_size, n_iteration - start_iteration + 1))
+
     # Training loop
     print("Training...")
     for iteration in range(start_iteration, n_iteration + 1):
-        training_batch = training_batches[iteration - 1]
+        training_batch = next(training_batches)
         # Extract fields from batch
         input_variable, lengths, target_variable, mask, max_target_len = training_batch
 
@@ -322,7 +400,8 @@ def trainIters(model_name, voc, pairs, encoder, decoder, encoder_optimizer, deco
 
         # Print progress
         if iteration % print_every == 0:
-            print_loss_avg = print_loss / print_every
+            # 每 print_every 次迭代只同步一次
+            print_loss_avg = print_loss.item() / print_every
             print("Iteration: {}; Percent complete: {:.1f}%; Average loss: {:.4f}".format(iteration, iteration / n_iteration * 100, print_loss_avg))
             print_loss = 0
 
@@ -337,7 +416,7 @@ def trainIters(model_name, voc, pairs, encoder, decoder, encoder_optimizer, deco
                 'de': decoder.state_dict(),
                 'en_opt': encoder_optimizer.state_dict(),
                 'de_opt': decoder_optimizer.state_dict(),
-                'loss': loss,
+                'loss': loss.item(),
                 'voc_dict': voc.__dict__,
                 'embedding': embedding.state_dict()
             }, os.path.join(directory, '{}_{}.tar'.format(iteration, 'checkpoint')))
@@ -0,0 +1,56 @@
+# batch 组装的 micro-benchmark：比较 zeroPadding + binaryMatrix 和 collate.padBatch
+# 用法：在 final_code_nn 目录下运行 python bench_collate.py
+import itertools
+import random
+import time
+import torch
+from models import MAX_LENGTH
+from collate import padBatch, PAD_token
+
+random.seed(0)
+num_words = 7826
+repeat = 20
+
+
+# 原来 nn_main.py / RNN_train.py 里的做法，作为对照
+def zeroPadding(l, fillvalue=PAD_token):
+    return list(itertools.zip_longest(*l, fillvalue=fillvalue))
+
+
+def binaryMatrix(l, value=PAD_token):
+    m = []
+    for i, seq in enumerate(l):
+        m.append([])
+        for token in seq:
+            if token == PAD_token:
+                m[i].append(0)
+            else:
+                m[i].append(1)
+    return m
+
+
+def old_collate(indexes_batch):
+    lengths = torch.tensor([len(indexes) for indexes in indexes_batch])
+    padList = zeroPadding(indexes_batch)
+    mask = torch.BoolTensor(binaryMatrix(padList))
+    padVar = torch.LongTensor(padList)
+    return padVar, lengths, mask
+
+
+def bench(collate, indexes_batch):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = collate(indexes_batch)
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+for batch_size in (64, 128, 256, 512, 1024):
+    # 和训练数据一样：1 到 MAX_LENGTH - 1 个词再加 EOS，按长度从长到短排好
+    indexes_batch = [[random.randrange(3, num_words) for _ in range(random.randint(1, MAX_LENGTH - 1))] + [2]
+                     for _ in range(batch_size)]
+    indexes_batch.sort(key=len, reverse=True)
+    old_ms, old_result = bench(old_collate, indexes_batch)
+    new_ms, new_result = bench(padBatch, indexes_batch)
+    assert all(torch.equal(a, b) for a, b in zip(old_result, new_result))
+    print("batch {:5d}: zeroPadding + binaryMatrix {:.3f} ms, padBatch {:.3f} ms ({:.1f}x)".format(
+        batch_size, old_ms, new_ms, old_ms / new_ms))
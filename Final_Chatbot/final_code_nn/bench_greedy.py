@@ -0,0 +1,46 @@
+# 贪心解码的 micro-benchmark：比较 GreedySearchDecoder 的原始模式和 fast 模式在 CPU 上每条回复的耗时
+# 用法：在 final_code_nn 目录下运行 python bench_greedy.py
+# 模型用随机权重，尺寸和 cb_model 相同（hidden 500，2 层，词表约 7800）
+import time
+import torch
+import torch.nn as nn
+from models import EncoderRNN, LuongAttnDecoderRNN, GreedySearchDecoder, EOS_token, MAX_LENGTH
+
+torch.set_num_threads(1)
+torch.manual_seed(0)
+
+hidden_size = 500
+n_layers = 2
+num_words = 7826
+sentence_len = 6
+repeat = 200
+
+embedding = nn.Embedding(num_words, hidden_size)
+encoder = EncoderRNN(hidden_size, embedding, n_layers, 0.1).eval()
+decoder = LuongAttnDecoderRNN('dot', embedding, hidden_size, num_words, n_layers, 0.1).eval()
+
+input_batch = torch.randint(3, num_words, (sentence_len, 1))
+input_batch[-1] = EOS_token
+lengths = torch.tensor([sentence_len])
+
+
+def bench(searcher):
+    with torch.no_grad():
+        for _ in range(10):
+            searcher(input_batch, lengths, MAX_LENGTH)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            tokens, _ = searcher(input_batch, lengths, MAX_LENGTH)
+        return (time.perf_counter() - start) / repeat * 1000, tokens
+
+
+# 通过调整 EOS 的偏置得到两种情况：一直解码到 max_length，以及几步之后就输出 EOS
+for eos_bias in (-10.0, 0.2):
+    with torch.no_grad():
+        decoder.out.bias[EOS_token] = eos_bias
+    slow_ms, slow_tokens = bench(GreedySearchDecoder(encoder, decoder, fast=False))
+    fast_ms, fast_tokens = bench(GreedySearchDecoder(encoder, decoder, fast=True))
+    assert torch.equal(slow_tokens[:fast_tokens.size(0)], fast_tokens)
+    print("EOS after {} of {} steps".format(fast_tokens.size(0), MAX_LENGTH))
+    print("  greedy      : {:.3f} ms/reply".format(slow_ms))
+    print("  fast greedy : {:.3f} ms/reply ({:.2f}x)".format(fast_ms, slow_ms / fast_ms))
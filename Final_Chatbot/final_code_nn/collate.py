@@ -0,0 +1,25 @@
+# seq2seq 的 batch 组装，训练（RNN_train.py）和推理（nn_main.py）共用
+# 下标直接写进预先分配好的 (max_len, batch) LongTensor，mask 由 padded != PAD_token 得到，
+# 代替 zeroPadding 的 zip_longest 转置和 binaryMatrix 的逐元素循环
+import itertools
+import numpy
+import torch
+
+PAD_token = 0  # Used for padding short sentences
+
+
+def padBatch(seqs, fillvalue=PAD_token):
+    # seqs 是若干个下标序列（list 或 numpy 数组），返回 (padded, lengths, mask)
+    # padded 和 mask 的形状都是 (max_len, batch)，lengths 留在 CPU 上给 pack_padded_sequence 用
+    lengths = torch.tensor([len(seq) for seq in seqs], dtype=torch.long)
+    max_len = int(lengths.max())
+    if isinstance(seqs[0], numpy.ndarray):
+        flat = numpy.concatenate(seqs).astype(numpy.int64, copy=False)
+    else:
+        flat = numpy.fromiter(itertools.chain.from_iterable(seqs), dtype=numpy.int64, count=int(lengths.sum()))
+    padded = torch.full((max_len, len(seqs)), fillvalue, dtype=torch.long)
+    # 按 (batch, 时间) 的顺序一次写入所有有效位置，和拼接后的顺序一致
+    valid = torch.arange(max_len).unsqueeze(0) < lengths.unsqueeze(1)
+    padded.t()[valid] = torch.from_numpy(flat)
+    mask = padded != PAD_token
+    return padded, lengths, mask
@@ -0,0 +1,88 @@
+# 导出推理用的单文件 bundle：
+# 意图分类模型 + seq2seq 模型的权重（不含优化器状态），词表打包成数组，回复按 tag 下标预先排好
+# 用法：在 final_code_nn 目录下运行 python export_bundle.py [输出文件名]
+# nn_main 发现 bundle.pt 时会用 torch.load(mmap=True) 直接映射加载
+import json
+import os
+import sys
+import torch
+
+model_name = 'cb_model'
+checkpoint_iter = 4000
+
+save_dir = os.path.join("data", "save")
+loadFilename = os.path.join(save_dir, '{}_checkpoint.tar'.format(checkpoint_iter))
+FILE = "data.pth"
+TRAIN_FILE = "traindata.json"
+BUNDLE_FILE = sys.argv[1] if len(sys.argv) > 1 else "bundle.pt"
+
+
+def pack_words(word_list):
+    # 单词数组打包成一个 uint8 数组，单词之间用 '\n' 分隔
+    return torch.frombuffer(bytearray('\n'.join(word_list).encode('utf-8')), dtype=torch.uint8)
+
+
+def seq2seq_config(checkpoint):
+    # 模型结构从 checkpoint 的权重里读出来，不依赖这里写死的常量
+    # 返回 (attn_model, hidden_size, encoder_n_layers, decoder_n_layers)
+    decoder_state = checkpoint['de']
+    if 'attn.v' in decoder_state:
+        attn_model = 'concat'
+    elif 'attn.attn.weight' in decoder_state:
+        attn_model = 'general'
+    else:
+        attn_model = 'dot'
+    hidden_size = checkpoint['embedding']['weight'].size(1)
+    encoder_n_layers = sum(1 for key in checkpoint['en'] if key.startswith('gru.weight_ih_l') and not key.endswith('_reverse'))
+    decoder_n_layers = sum(1 for key in decoder_state if key.startswith('gru.weight_ih_l'))
+    return attn_model, hidden_size, encoder_n_layers, decoder_n_layers
+
+
+def export_intent():
+    data = torch.load(FILE, map_location=torch.device('cpu'))
+    with open(TRAIN_FILE, 'r') as f:
+        TrainArray = json.load(f)
+    tag_responses = {}
+    for i in TrainArray['traindata']:
+        tag_responses.setdefault(i['tag'], i['responses'])
+    return {
+        "model_state": data["model_state"],
+        "input_size": data["input_size"],
+        "hidden_size": data["hidden_size"],
+        "output_size": data["output_size"],
+        "words": pack_words(data['words']),
+        "words_weight": torch.tensor(data['words_weight'], dtype=torch.float32),
+        "tags": data['tags'],
+        # 与 tags 下标对齐
+        "responses": [tag_responses.get(tag, []) for tag in data['tags']]
+    }
+
+
+def export_seq2seq():
+    checkpoint = torch.load(loadFilename, map_location=torch.device('cpu'))
+    voc_dict = checkpoint['voc_dict']
+    # index2word 的下标是 0..num_words-1 连续的，按下标顺序打包即可
+    index2word = [voc_dict['index2word'][index] for index in range(voc_dict['num_words'])]
+    attn_model, hidden_size, encoder_n_layers, decoder_n_layers = seq2seq_config(checkpoint)
+    # 只保留推理需要的权重，去掉 en_opt / de_opt 两份 Adam 状态
+    return {
+        "en": checkpoint['en'],
+        "de": checkpoint['de'],
+        "embedding": checkpoint['embedding'],
+        "name": voc_dict['name'],
+        "index2word": pack_words(index2word),
+        "attn_model": attn_model,
+        "hidden_size": hidden_size,
+        "encoder_n_layers": encoder_n_layers,
+        "decoder_n_layers": decoder_n_layers
+    }
+
+
+if __name__ == '__main__':
+    bundle = {"intent": export_intent()}
+    if os.path.exists(loadFilename):
+        bundle["seq2seq"] = export_seq2seq()
+    else:
+        print("No seq2seq checkpoint at {}, exporting the intent model only".format(loadFilename))
+    torch.save(bundle, BUNDLE_FILE)
+    print("Saved inference bundle to {} ({:.1f} MB)".format(BUNDLE_FILE, os.path.getsize(BUNDLE_FILE) / 2 ** 20))
@@ -0,0 +1,325 @@
+# 模型的定义：意图分类用的 ChatNN，seq2seq 的 EncoderRNN、Luong attention 的 decoder，以及贪心 / beam search 解码
+# 只有类和常量的定义，import 时不加载任何模型文件
+# nn_main.py、FNN_train.py、sweep.py 和 bench_greedy.py 都从这里导入，训练、调参和推理用的是同一个模型
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+USE_CUDA = torch.cuda.is_available()
+device = torch.device("cuda" if USE_CUDA else "cpu")
+
+MAX_LENGTH = 10
+PAD_token = 0  # Used for padding short sentences
+SOS_token = 1  # Start-of-sentence token
+EOS_token = 2  # End-of-sentence token
+
+
+class ChatNN(nn.Module):
+    # 需要自己写初始化和forward函数
+    def __init__(self, input_size, hidden_size, output_size):
+        super(ChatNN, self).__init__()   # 默认要加这一行，调用父类的初始化操作
+        self.linear0 = nn.Linear(input_size, hidden_size)
+        self.linear1 = nn.Linear(hidden_size, hidden_size)
+        self.linear2 = nn.Linear(hidden_size, output_size)
+        self.relu = nn.ReLU()
+
+    def forward(self, input_x):
+        # 拼写检查要注意
+        output_mid = self.linear0(input_x)
+        output_mid = self.relu(output_mid)
+        output_mid = self.linear1(output_mid)
+        output_mid = self.relu(output_mid)
+        output_mid = self.linear1(output_mid)
+        output_mid = self.relu(output_mid)
+        output_mid = self.linear1(output_mid)
+        output_mid = self.relu(output_mid)
+        output_final = self.linear2(output_mid)
+        return output_final
+
+
+class EncoderRNN(nn.Module):
+    def __init__(self, hidden_size, embedding, n_layers=1, dropout=0):
+        super(EncoderRNN, self).__init__()
+        self.n_layers = n_layers
+        self.hidden_size = hidden_size
+        self.embedding = embedding
+
+        # Initialize GRU; the input_size and hidden_size params are both set to 'hidden_size'
+        #   because our input size is a word embedding with number of features == hidden_size
+
+        self.gru = nn.GRU(hidden_size, hidden_size, n_layers,
+                          dropout=(0 if n_layers == 1 else dropout), bidirectional=True)
+
+    def forward(self, input_seq, input_lengths, hidden=None):
+        # Convert word indexes to embeddings
+        embedded = self.embedding(input_seq)
+        # Pack padded batch of sequences for RNN module
+        packed = nn.utils.rnn.pack_padded_sequence(embedded, input_lengths)
+        # Forward pass through GRU
+        outputs, hidden = self.gru(packed, hidden)
+        # Unpack padding
+        outputs, _ = nn.utils.rnn.pad_packed_sequence(outputs)
+        # Sum bidirectional GRU outputs
+        outputs = outputs[:, :, :self.hidden_size] + outputs[:, :, self.hidden_size:]
+        # Return output and final hidden state
+        return outputs, hidden
+
+
+# Luong attention layer
+class Attn(nn.Module):
+    def __init__(self, method, hidden_size):
+        super(Attn, self).__init__()
+        self.method = method
+        if self.method not in ['dot', 'general', 'concat']:
+            raise ValueError(self.method, "is not an appropriate attention method.")
+        self.hidden_size = hidden_size
+        if self.method == 'general':
+            self.attn = nn.Linear(self.hidden_size, hidden_size)
+        elif self.method == 'concat':
+            self.attn = nn.Linear(self.hidden_size * 2, hidden_size)
+            self.v = nn.Parameter(torch.FloatTensor(hidden_size))
+
+    def dot_score(self, hidden, encoder_output):
+        return torch.sum(hidden * encoder_output, dim=2)
+
+    def general_score(self, hidden, encoder_output):
+        energy = self.attn(encoder_output)
+        return torch.sum(hidden * energy, dim=2)
+
+    def concat_score(self, hidden, encoder_output):
+        energy = self.attn(torch.cat((hidden.expand(encoder_output.size(0), -1, -1), encoder_output), 2)).tanh()
+        return torch.sum(self.v * energy, dim=2)
+
+    def forward(self, hidden, encoder_outputs, mask=None):
+        # mask 的 shape 是 (batch, max_length)，False 的位置是 padding，不参与 attention
+        # Calculate the attention weights (energies) based on the given method
+        if self.method == 'general':
+            attn_energies = self.general_score(hidden, encoder_outputs)
+        elif self.method == 'concat':
+            attn_energies = self.concat_score(hidden, encoder_outputs)
+        elif self.method == 'dot':
+            attn_energies = self.dot_score(hidden, encoder_outputs)
+
+        # Transpose max_length and batch_size dimensions
+        attn_energies = attn_energies.t()
+        if mask is not None:
+            attn_energies = attn_energies.masked_fill(~mask, float('-inf'))
+
+        # Return the softmax normalized probability scores (with added dimension)
+        return F.softmax(attn_energies, dim=1).unsqueeze(1)
+
+class LuongAttnDecoderRNN(nn.Module):
+    def __init__(self, attn_model, embedding, hidden_size, output_size, n_layers=1, dropout=0.1):
+        super(LuongAttnDecoderRNN, self).__init__()
+        # 保存到self里，attn_model就是前面定义的Attn类的对象。
+        # Keep for reference
+        self.attn_model = attn_model
+        self.hidden_size = hidden_size
+        self.output_size = output_size
+        self.n_layers = n_layers
+        self.dropout = dropout
+
+        # Define layers
+        # 定义Decoder的layers
+        self.embedding = embedding
+        self.embedding_dropout = nn.Dropout(dropout)
+        self.gru = nn.GRU(hidden_size, hidden_size, n_layers, dropout=(0 if n_layers == 1 else dropout))
+        self.concat = nn.Linear(hidden_size * 2, hidden_size)
+        self.out = nn.Linear(hidden_size, output_size)
+
+        self.attn = Attn(attn_model, hidden_size)
+
+    def forward(self, input_step, last_hidden, encoder_outputs, encoder_outputs_t=None, encoder_mask=None):
+        # encoder_outputs_t 是解码前缓存好的 encoder_outputs.transpose(0, 1)，传入后每一步不再重新转置
+        # encoder_mask 标出 batch 里每个句子的有效位置，长短不一的句子一起解码时使用
+        # 注意：decoder每一步只能处理一个时刻的数据，因为t时刻计算完了才能计算t+1时刻。
+        # input_step的shape是(1, 64)，64是batch，1是当前输入的词ID(来自上一个时刻的输出)
+        # 通过embedding层变成(1, 64, 500)，然后进行dropout，shape不变。
+        # Note: we run this one step (word) at a time
+        # Get embedding of current input word
+        embedded = self.embedding(input_step)
+        embedded = self.embedding_dropout(embedded)
+        # 把embedded传入GRU进行forward计算
+        # 得到rnn_output的shape是(1, 64, 500)
+        # hidden是(2, 64, 500)，因为是双向的GRU，所以第一维是2。
+        # Forward through unidirectional GRU
+        rnn_output, hidden = self.gru(embedded, last_hidden)
+        # 计算注意力权重， 根据前面的分析，attn_weights的shape是(64, 1, 10)
+        # Calculate attention weights from the current GRU output
+        attn_weights = self.attn(rnn_output, encoder_outputs, encoder_mask)
+        # encoder_outputs是(10, 64, 500)
+        # encoder_outputs.transpose(0, 1)后的shape是(64, 10, 500)
+        # attn_weights.bmm后是(64, 1, 500)
+
+        # bmm是批量的矩阵乘法，第一维是batch，我们可以把attn_weights看成64个(1,10)的矩阵
+        # 把encoder_outputs.transpose(0, 1)看成64个(10, 500)的矩阵
+        # 那么bmm就是64个(1, 10)矩阵 x (10, 500)矩阵，最终得到(64, 1, 500)
+        # Multiply attention weights to encoder outputs to get new "weighted sum" context vector
+        if encoder_outputs_t is None:
+            encoder_outputs_t = encoder_outputs.transpose(0, 1)
+        context = attn_weights.bmm(encoder_outputs_t)
+        # 把context向量和GRU的输出拼接起来
+        # rnn_output从(1, 64, 500)变成(64, 500)
+        # Concatenate weighted context vector and GRU output using Luong eq. 5
+        rnn_output = rnn_output.squeeze(0)
+        # context从(64, 1, 500)变成(64, 500)
+        context = context.squeeze(1)
+        # 拼接得到(64, 1000)
+        concat_input = torch.cat((rnn_output, context), 1)
+        # self.concat是一个矩阵(1000, 500)，
+        # self.concat(concat_input)的输出是(64, 500)
+        # 然后用tanh把输出返回变成(-1,1)，concat_output的shape是(64, 500)
+        concat_output = torch.tanh(self.concat(concat_input))
+        # out是(500, 词典大小=7826)
+        # Predict next word using Luong eq. 6
+        output = self.out(concat_output)
+        # 用softmax变成概率，表示当前时刻输出每个词的概率。
+        output = F.softmax(output, dim=1)
+        # 返回 output和新的隐状态
+        # Return output and final hidden state
+        return output, hidden
+
+
+class GreedySearchDecoder(nn.Module):
+    # fast=True 时遇到 EOS 提前结束、结果写入预先分配的 buffer，并且每句话只转置一次 encoder_outputs
+    # fast=False 保留原来的做法：固定解码 max_length 步，每步用 torch.cat 拼接结果
+    def __init__(self, encoder, decoder, fast=True):
+        super(GreedySearchDecoder, self).__init__()
+        self.encoder = encoder
+        self.decoder = decoder
+        self.fast = fast
+
+    def forward(self, input_seq, input_length, max_length):
+        # Encoder的Forward计算
+        encoder_outputs, encoder_hidden = self.encoder(input_seq, input_length)
+        # 把Encoder最后时刻的隐状态作为Decoder的初始值
+        decoder_hidden = encoder_hidden[:self.decoder.n_layers]
+        # 因为我们的函数都是要求(time,batch)，因此即使只有一个数据，也要做出二维的。
+        # Decoder的初始输入是SOS
+        decoder_input = torch.ones(1, 1, device=device, dtype=torch.long) * SOS_token
+        if self.fast:
+            return self.fast_forward(encoder_outputs, decoder_hidden, decoder_input, max_length)
+        # 用于保存解码结果的tensor
+        all_tokens = torch.zeros([0], device=device, dtype=torch.long)
+        all_scores = torch.zeros([0], device=device)
+        # 循环，这里只使用长度限制，后面处理的时候把EOS去掉了。
+        for _ in range(max_length):
+            # Decoder forward一步
+            decoder_output, decoder_hidden = self.decoder(decoder_input, decoder_hidden,
+								encoder_outputs)
+            # decoder_outputs是(batch=1, vob_size)
+            # 使用max返回概率最大的词和得分
+            decoder_scores, decoder_input = torch.max(decoder_output, dim=1)
+            # 把解码结果保存到all_tokens和all_scores里
+            all_tokens = torch.cat((all_tokens, decoder_input), dim=0)
+            all_scores = torch.cat((all_scores, decoder_scores), dim=0)
+            # decoder_input是当前时刻输出的词的ID，这是个一维的向量，因为max会减少一维。
+            # 但是decoder要求有一个batch维度，因此用unsqueeze增加batch维度。
+            decoder_input = torch.unsqueeze(decoder_input, 0)
+        # 返回所有的词和得分。
+        return all_tokens, all_scores
+
+    def fast_forward(self, encoder_outputs, decoder_hidden, decoder_input, max_length):
+        # 转置后的 encoder_outputs 每句话只算一次
+        encoder_outputs_t = encoder_outputs.transpose(0, 1).contiguous()
+        all_tokens = torch.zeros(max_length, device=device, dtype=torch.long)
+        all_scores = torch.zeros(max_length, device=device)
+        for t in range(max_length):
+            decoder_output, decoder_hidden = self.decoder(decoder_input, decoder_hidden,
+                                                          encoder_outputs, encoder_outputs_t)
+            decoder_scores, decoder_input = torch.max(decoder_output, dim=1)
+            all_tokens[t] = decoder_input[0]
+            all_scores[t] = decoder_scores[0]
+            # 输出 EOS 后面的内容反正会被去掉，直接结束
+            if decoder_input.item() == EOS_token:
+                break
+            decoder_input = torch.unsqueeze(decoder_input, 0)
+        return all_tokens[:t + 1], all_scores[:t + 1]
+
+
+class BeamSearchDecoder(nn.Module):
+    # beam search：K 个候选放在同一个 batch 里一起 forward，每一步只调用一次 decoder
+    def __init__(self, encoder, decoder, beam_size=5):
+        super(BeamSearchDecoder, self).__init__()
+        self.encoder = encoder
+        self.decoder = decoder
+        self.beam_size = beam_size
+
+    def forward(self, input_seq, input_length, max_length):
+        encoder_outputs, encoder_hidden = self.encoder(input_seq, input_length)
+        decoder_hidden = encoder_hidden[:self.decoder.n_layers]
+        # 第一步只有一个候选(SOS)，之后扩展成 beam_size 个，encoder_outputs 只做 expand 不拷贝
+        beam_encoder_outputs = encoder_outputs.expand(-1, self.beam_size, -1)
+        beam_encoder_outputs_t = encoder_outputs.transpose(0, 1).contiguous().expand(self.beam_size, -1, -1)
+        decoder_input = torch.full((1, 1), SOS_token, device=device, dtype=torch.long)
+        # 预先分配好保存结果的 buffer，每个候选一行
+        all_tokens = torch.zeros(self.beam_size, max_length, device=device, dtype=torch.long)
+        all_scores = torch.zeros(self.beam_size, max_length, device=device)
+        beam_scores = torch.zeros(1, device=device)
+        beam_lengths = torch.zeros(1, device=device)
+        finished = torch.zeros(1, device=device, dtype=torch.bool)
+        for t in range(max_length):
+            n_beams = decoder_input.size(1)
+            decoder_output, decoder_hidden = self.decoder(decoder_input, decoder_hidden,
+                                                          beam_encoder_outputs[:, :n_beams],
+                                                          beam_encoder_outputs_t[:n_beams])
+            log_probs = torch.log(decoder_output)
+            # 已经输出 EOS 的候选只能接 PAD，得分不变，也不会和别的候选重复
+            log_probs[finished] = float('-inf')
+            log_probs[finished, PAD_token] = 0
+            # 所有候选 x 所有词里选得分最高的 beam_size 个
+            candidates = (beam_scores.unsqueeze(1) + log_probs).view(-1)
+            beam_scores, flat_index = candidates.topk(min(self.beam_size, candidates.size(0)))
+            beam_index = flat_index // log_probs.size(1)
+            word_index = flat_index % log_probs.size(1)
+
+            n_beams = beam_index.size(0)
+            all_tokens[:n_beams] = all_tokens[beam_index]
+            all_scores[:n_beams] = all_scores[beam_index]
+            all_tokens[:n_beams, t] = word_index
+            all_scores[:n_beams, t] = log_probs[beam_index, word_index].exp()
+            beam_lengths = beam_lengths[beam_index] + (~finished[beam_index]).float()
+            finished = finished[beam_index] | (word_index == EOS_token)
+
+            decoder_hidden = decoder_hidden[:, beam_index]
+            decoder_input = word_index.unsqueeze(0)
+            # 所有候选都输出 EOS 之后提前结束
+            if finished.all():
+                break
+        # 按长度归一化后的得分选出最好的候选，避免偏向短句
+        best = torch.argmax(beam_scores / beam_lengths)
+        return all_tokens[best, :t + 1], all_scores[best, :t + 1]
+
+class BatchGreedySearchDecoder(nn.Module):
+    # 多个会话的句子放在同一个 batch 里一起贪心解码
+    # 已经输出 EOS 的行之后都填 PAD，所有行都结束后提前退出
+    def __init__(self, encoder, decoder):
+        super(BatchGreedySearchDecoder, self).__init__()
+        self.encoder = encoder
+        self.decoder = decoder
+
+    def forward(self, input_seq, input_lengths, max_length):
+        # input_seq 是 (max_len, batch)，句子按长度从长到短排好，encoder 里用 pack_padded_sequence
+        encoder_outputs, encoder_hidden = self.encoder(input_seq, input_lengths)
+        batch_size = input_seq.size(1)
+        decoder_hidden = encoder_hidden[:self.decoder.n_layers]
+        encoder_outputs_t = encoder_outputs.transpose(0, 1).contiguous()
+        # padding 的位置不参与 attention，这样每一行的结果和单独解码时一样
+        encoder_mask = torch.arange(encoder_outputs.size(0), device=device).unsqueeze(0) \
+            < input_lengths.to(device).unsqueeze(1)
+        decoder_input = torch.full((1, batch_size), SOS_token, device=device, dtype=torch.long)
+        all_tokens = torch.full((max_length, batch_size), PAD_token, device=device, dtype=torch.long)
+        all_scores = torch.zeros(max_length, batch_size, device=device)
+        finished = torch.zeros(batch_size, device=device, dtype=torch.bool)
+        for t in range(max_length):
+            decoder_output, decoder_hidden = self.decoder(decoder_input, decoder_hidden, encoder_outputs,
+                                                          encoder_outputs_t, encoder_mask)
+            decoder_scores, decoder_tokens = torch.max(decoder_output, dim=1)
+            all_tokens[t] = decoder_tokens.masked_fill(finished, PAD_token)
+            all_scores[t] = decoder_scores.masked_fill(finished, 0)
+            finished = finished | (decoder_tokens == EOS_token)
+            if finished.all():
+                break
+            decoder_input = decoder_tokens.unsqueeze(0)
+        # 返回 (步数, batch) 的词和得分
+        return all_tokens[:t + 1], all_scores[:t + 1]
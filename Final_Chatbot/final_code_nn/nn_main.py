@@ -9,152 +9,18 @@ import os
 import unicodedata
 from io import open
 import itertools
-import torch.nn.functional as F
-
-USE_CUDA = torch.cuda.is_available()
-device = torch.device("cuda" if USE_CUDA else "cpu")
-
-MAX_LENGTH = 10
-PAD_token = 0  # Used for padding short sentences
-SOS_token = 1  # Start-of-sentence tokenjw`1   \
-
-EOS_token = 2  # End-of-sentence token
-
-
-class EncoderRNN(nn.Module):
-    def __init__(self, hidden_size, embedding, n_layers=1, dropout=0):
-        super(EncoderRNN, self).__init__()
-        self.n_layers = n_layers
-        self.hidden_size = hidden_size
-        self.embedding = embedding
-
-        # Initialize GRU; the input_size and hidden_size params are both set to 'hidden_size'
-        #   because our input size is a word embedding with number of features == hidden_size
-
-        self.gru = nn.GRU(hidden_size, hidden_size, n_layers,
-                          dropout=(0 if n_layers == 1 else dropout), bidirectional=True)
-
-    def forward(self, input_seq, input_lengths, hidden=None):
-        # Convert word indexes to embeddings
-        embedded = self.embedding(input_seq)
-        # Pack padded batch of sequences for RNN module
-        packed = nn.utils.rnn.pack_padded_sequence(embedded, input_lengths)
-        # Forward pass through GRU
-        outputs, hidden = self.gru(packed, hidden)
-        # Unpack padding
-        outputs, _ = nn.utils.rnn.pad_packed_sequence(outputs)
-        # Sum bidirectional GRU outputs
-        outputs = outputs[:, :, :self.hidden_size] + outputs[:, :, self.hidden_size:]
-        # Return output and final hidden state
-        return outputs, hidden
-
-
-# Luong attention layer
-class Attn(nn.Module):
-    def __init__(self, method, hidden_size):
-        super(Attn, self).__init__()
-        self.method = method
-        if self.method not in ['dot', 'general', 'concat']:
-            raise ValueError(self.method, "is not an appropriate attention method.")
-        self.hidden_size = hidden_size
-        if self.method == 'general':
-            self.attn = nn.Linear(self.hidden_size, hidden_size)
-        elif self.method == 'concat':
-            self.attn = nn.Linear(self.hidden_size * 2, hidden_size)
-            self.v = nn.Parameter(torch.FloatTensor(hidden_size))
-
-    def dot_score(self, hidden, encoder_output):
-        return torch.sum(hidden * encoder_output, dim=2)
-
-    def general_score(self, hidden, encoder_output):
-        energy = self.attn(encoder_output)
-        return torch.sum(hidden * energy, dim=2)
-
-    def concat_score(self, hidden, encoder_output):
-        energy = self.attn(torch.cat((hidden.expand(encoder_output.size(0), -1, -1), encoder_output), 2)).tanh()
-        return torch.sum(self.v * energy, dim=2)
-
-    def forward(self, hidden, encoder_outputs):
-        # Calculate the attention weights (energies) based on the given method
-        if self.method == 'general':
-            attn_energies = self.general_score(hidden, encoder_outputs)
-        elif self.method == 'concat':
-            attn_energies = self.concat_score(hidden, encoder_outputs)
-        elif self.method == 'dot':
-            attn_energies = self.dot_score(hidden, encoder_outputs)
-
-        # Transpose max_length and batch_size dimensions
-        attn_energies = attn_energies.t()
-
-        # Return the softmax normalized probability scores (with added dimension)
-        return F.softmax(attn_energies, dim=1).unsqueeze(1)
-
-class LuongAttnDecoderRNN(nn.Module):
-    def __init__(self, attn_model, embedding, hidden_size, output_size, n_layers=1, dropout=0.1):
-        super(LuongAttnDecoderRNN, self).__init__()
-        # 保存到self里，attn_model就是前面定义的Attn类的对象。
-        # Keep for reference
-        self.attn_model = attn_model
-        self.hidden_size = hidden_size
-        self.output_size = output_size
-        self.n_layers = n_layers
-        self.dropout = dropout
-
-        # Define layers
-        # 定义Decoder的layers
-        self.embedding = embedding
-        self.embedding_dropout = nn.Dropout(dropout)
-        self.gru = nn.GRU(hidden_size, hidden_size, n_layers, dropout=(0 if n_layers == 1 else dropout))
-        self.concat = nn.Linear(hidden_size * 2, hidden_size)
-        self.out = nn.Linear(hidden_size, output_size)
-
-        self.attn = Attn(attn_model, hidden_size)
-
-    def forward(self, input_step, last_hidden, encoder_outputs):
-        # 注意：decoder每一步只能处理一个时刻的数据，因为t时刻计算完了才能计算t+1时刻。
-        # input_step的shape是(1, 64)，64是batch，1是当前输入的词ID(来自上一个时刻的输出)
-        # 通过embedding层变成(1, 64, 500)，然后进行dropout，shape不变。
-        # Note: we run this one step (word) at a time
-        # Get embedding of current input word
-        embedded = self.embedding(input_step)
-        embedded = self.embedding_dropout(embedded)
-        # 把embedded传入GRU进行forward计算
-        # 得到rnn_output的shape是(1, 64, 500)
-        # hidden是(2, 64, 500)，因为是双向的GRU，所以第一维是2。
-        # Forward through unidirectional GRU
-        rnn_output, hidden = self.gru(embedded, last_hidden)
-        # 计算注意力权重， 根据前面的分析，attn_weights的shape是(64, 1, 10)
-        # Calculate attention weights from the current GRU output
-        attn_weights = self.attn(rnn_output, encoder_outputs)
-        # encoder_outputs是(10, 64, 500)
-        # encoder_outputs.transpose(0, 1)后的shape是(64, 10, 500)
-        # attn_weights.bmm后是(64, 1, 500)
-
-        # bmm是批量的矩阵乘法，第一维是batch，我们可以把attn_weights看成64个(1,10)的矩阵
-        # 把encoder_outputs.transpose(0, 1)看成64个(10, 500)的矩阵
-        # 那么bmm就是64个(1, 10)矩阵 x (10, 500)矩阵，最终得到(64, 1, 500)
-        # Multiply attention weights to encoder outputs to get new "weighted sum" context vector
-        context = attn_weights.bmm(encoder_outputs.transpose(0, 1))
-        # 把context向量和GRU的输出拼接起来
-        # rnn_output从(1, 64, 500)变成(64, 500)
-        # Concatenate weighted context vector and GRU output using Luong eq. 5
-        rnn_output = rnn_output.squeeze(0)
-        # context从(64, 1, 500)变成(64, 500)
-        context = context.squeeze(1)
-        # 拼接得到(64, 1000)
-        concat_input = torch.cat((rnn_output, context), 1)
-        # self.concat是一个矩阵(1000, 500)，
-        # self.concat(concat_input)的输出是(64, 500)
-        # 然后用tanh把输出返回变成(-1,1)，concat_output的shape是(64, 500)
-        concat_output = torch.tanh(self.concat(concat_input))
-        # out是(500, 词典大小=7826)
-        # Predict next word using Luong eq. 6
-        output = self.out(concat_output)
-        # 用softmax变成概率，表示当前时刻输出每个词的概率。
-        output = F.softmax(output, dim=1)
-        # 返回 output和新的隐状态
-        # Return output and final hidden state
-        return output, hidden
+import threading
+try:
+    from final_code_nn.collate import padBatch
+    from final_code_nn.models import (device, MAX_LENGTH, PAD_token, SOS_token, EOS_token, ChatNN, EncoderRNN, Attn,
+                                      LuongAttnDecoderRNN, GreedySearchDecoder, BeamSearchDecoder,
+                                      BatchGreedySearchDecoder)
+except ImportError:
+    # 在 final_code_nn 目录下直接导入 nn_main 时
+    from collate import padBatch
+    from models import (device, MAX_LENGTH, PAD_token, SOS_token, EOS_token, ChatNN, EncoderRNN, Attn,
+                        LuongAttnDecoderRNN, GreedySearchDecoder, BeamSearchDecoder, BatchGreedySearchDecoder)
+
 
 def maskNLLLoss(inp, target, mask):
     # 计算实际的词的个数，因为padding是0，非padding是1，因此sum就可以得到词的个数
@@ -246,20 +112,14 @@ def binaryMatrix(l, value=PAD_token):
 
 def inputVar(l, voc):
     indexes_batch = [indexesFromSentence(voc, sentence) for sentence in l]
-    lengths = torch.tensor([len(indexes) for indexes in indexes_batch])
-    padList = zeroPadding(indexes_batch)
-    padVar = torch.LongTensor(padList)
+    padVar, lengths, _ = padBatch(indexes_batch)
     return padVar, lengths
 
 # Returns padded target sequence tensor, padding mask, and max target length
 def outputVar(l, voc):
     indexes_batch = [indexesFromSentence(voc, sentence) for sentence in l]
-    max_target_len = max([len(indexes) for indexes in indexes_batch])
-    padList = zeroPadding(indexes_batch)
-    mask = binaryMatrix(padList)
-    mask = torch.BoolTensor(mask)
-    padVar = torch.LongTensor(padList)
-    return padVar, mask, max_target_len
+    padVar, _, mask = padBatch(indexes_batch)
+    return padVar, mask, padVar.size(0)
 
 def batch2TrainData(voc, pair_batch):
     pair_batch.sort(key=lambda x: len(x[0].split(" ")), reverse=True)
@@ -317,77 +177,73 @@ def loadPrepareData(corpus, corpus_name, datafile, save_dir):
 
 corpus_name = "cornell movie-dialogs corpus" #语料库的名字
 corpus = os.path.join("data", corpus_name)
-# Load/Assemble voc and pairs
-datafile = os.path.join(corpus, "formatted_movie_lines.txt")
-datafile = 'C:\\Users\\86138\\Desktop\\Chatbot\\final_code_nn\\' + datafile
 save_dir = os.path.join("data", "save")
 save_dir = 'C:\\Users\\86138\\Desktop\\Chatbot\\final_code_nn\\' + save_dir
-voc, pairs = loadPrepareData(corpus, corpus_name, datafile, save_dir)
 
 
 model_name = 'cb_model'
 attn_model = 'dot'
 #attn_model = 'general'
 #attn_model = 'concat'
-hidden_size = 500
+rnn_hidden_size = 500
 encoder_n_layers = 2
 decoder_n_layers = 2
 dropout = 0.1
 batch_size = 64
 
-# Set checkpoint to load from; set to None if starting from scratch
-#loadFilename = None
+# Set checkpoint to load from
 checkpoint_iter = 4000
 loadFilename = os.path.join(save_dir, '{}_checkpoint.tar'.format(checkpoint_iter))
 
+# seq2seq 兜底模型按需加载：第一次置信度不够时才读 checkpoint 并建 encoder/decoder
+seq2seq = None
+seq2seq_lock = threading.Lock()
+
+
+def load_seq2seq():
+    # 返回 (encoder, decoder, searcher, voc)，只在第一次调用时真正加载
+    # Voc 直接从 checkpoint 里的 voc_dict 重建，不再读取和归一化整个语料库
+    global seq2seq
+    with seq2seq_lock:
+        if seq2seq is None:
+            if bundle is not None and "seq2seq" in bundle:
+                checkpoint = bundle["seq2seq"]
+                voc = Voc(checkpoint['name'])
+                for word in unpack_words(checkpoint['index2word'])[voc.num_words:]:
+                    voc.addWord(word)
+                # 按 bundle 里记录的结构建模型，导出时用的配置和上面的常量不同也能正确加载
+                config = (checkpoint['attn_model'], checkpoint['hidden_size'],
+                          checkpoint['encoder_n_layers'], checkpoint['decoder_n_layers'])
+            else:
+                # If loading a model trained on GPU to CPU
+                checkpoint = torch.load(loadFilename, map_location=torch.device('cpu'))
+                voc = Voc(corpus_name)
+                voc.__dict__ = checkpoint['voc_dict']
+                config = (attn_model, rnn_hidden_size, encoder_n_layers, decoder_n_layers)
+            model_attn, model_hidden_size, model_encoder_n_layers, model_decoder_n_layers = config
+
+            embedding = nn.Embedding(voc.num_words, model_hidden_size)
+            # assign=True：参数直接用 checkpoint 里的张量，bundle 按内存映射加载时权重不再复制一份，多个进程共享同一份页缓存
+            embedding.load_state_dict(checkpoint['embedding'], assign=True)
+            # Initialize encoder & decoder models
+            encoder = EncoderRNN(model_hidden_size, embedding, model_encoder_n_layers, dropout)
+            decoder = LuongAttnDecoderRNN(model_attn, embedding, model_hidden_size, voc.num_words,
+                                          model_decoder_n_layers, dropout)
+            encoder.load_state_dict(checkpoint['en'], assign=True)
+            decoder.load_state_dict(checkpoint['de'], assign=True)
+            # Use appropriate device
+            encoder = encoder.to(device)
+            decoder = decoder.to(device)
+
+            # 进入eval模式，从而去掉dropout。
+            encoder.eval()
+            decoder.eval()
+
+            # 构造searcher对象
+            searcher = GreedySearchDecoder(encoder, decoder)
+            seq2seq = (encoder, decoder, searcher, voc)
+    return seq2seq
 
-# Load model if a loadFilename is provided
-if loadFilename:
-    # If loading on same machine the model was trained on
-    #checkpoint = torch.load(loadFilename)
-    # If loading a model trained on GPU to CPU
-    checkpoint = torch.load(loadFilename, map_location=torch.device('cpu'))
-    encoder_sd = checkpoint['en']
-    decoder_sd = checkpoint['de']
-    encoder_optimizer_sd = checkpoint['en_opt']
-    decoder_optimizer_sd = checkpoint['de_opt']
-    embedding_sd = checkpoint['embedding']
-    voc.__dict__ = checkpoint['voc_dict']
-
-
-class GreedySearchDecoder(nn.Module):
-    def __init__(self, encoder, decoder):
-        super(GreedySearchDecoder, self).__init__()
-        self.encoder = encoder
-        self.decoder = decoder
-
-    def forward(self, input_seq, input_length, max_length):
-        # Encoder的Forward计算
-        encoder_outputs, encoder_hidden = self.encoder(input_seq, input_length)
-        # 把Encoder最后时刻的隐状态作为Decoder的初始值
-        decoder_hidden = encoder_hidden[:decoder.n_layers]
-        # 因为我们的函数都是要求(time,batch)，因此即使只有一个数据，也要做出二维的。
-        # Decoder的初始输入是SOS
-        decoder_input = torch.ones(1, 1, device=device, dtype=torch.long) * SOS_token
-        # 用于保存解码结果的tensor
-        all_tokens = torch.zeros([0], device=device, dtype=torch.long)
-        all_scores = torch.zeros([0], device=device)
-        # 循环，这里只使用长度限制，后面处理的时候把EOS去掉了。
-        for _ in range(max_length):
-            # Decoder forward一步
-            decoder_output, decoder_hidden = self.decoder(decoder_input, decoder_hidden,
-								encoder_outputs)
-            # decoder_outputs是(batch=1, vob_size)
-            # 使用max返回概率最大的词和得分
-            decoder_scores, decoder_input = torch.max(decoder_output, dim=1)
-            # 把解码结果保存到all_tokens和all_scores里
-            all_tokens = torch.cat((all_tokens, decoder_input), dim=0)
-            all_scores = torch.cat((all_scores, decoder_scores), dim=0)
-            # decoder_input是当前时刻输出的词的ID，这是个一维的向量，因为max会减少一维。
-            # 但是decoder要求有一个batch维度，因此用unsqueeze增加batch维度。
-            decoder_input = torch.unsqueeze(decoder_input, 0)
-        # 返回所有的词和得分。
-        return all_tokens, all_scores
 
 def evaluate(encoder, decoder, searcher, voc, sentence, max_length=MAX_LENGTH):
     ### 把输入的一个batch句子变成id
@@ -407,15 +263,60 @@ def evaluate(encoder, decoder, searcher, voc, sentence, max_length=MAX_LENGTH):
     # 放到合适的设备上(比如GPU)
     input_batch = input_batch.to(device)
     lengths = lengths.to(device)
-    # 用searcher解码
-    tokens, scores = searcher(input_batch, lengths, max_length)
+    # 用searcher解码，推理时不需要记录梯度
+    with torch.no_grad():
+        tokens, scores = searcher(input_batch, lengths, max_length)
     print(4)
     # ID变成词。
     decoded_words = [voc.index2word[token.item()] for token in tokens]
     return decoded_words
 
 
-def evaluateInput(encoder, decoder, searcher, voc, input_sen):
+def evaluateBatch(encoder, decoder, voc, sentences, max_length=MAX_LENGTH):
+    # 一次解码多句话，返回和 sentences 一一对应的词数组；有未知词的句子和 evaluate 一样返回 -1
+    indexes_batch = [indexesFromSentence(voc, sentence) for sentence in sentences]
+    results = [-1] * len(sentences)
+    # pack_padded_sequence 要求按长度从长到短排列，记下原来的位置
+    order = [i for i in range(len(sentences)) if indexes_batch[i] != []]
+    if not order:
+        return results
+    order.sort(key=lambda i: len(indexes_batch[i]), reverse=True)
+    input_batch, lengths, _ = padBatch([indexes_batch[i] for i in order])
+    input_batch = input_batch.to(device)
+    searcher = BatchGreedySearchDecoder(encoder, decoder)
+    with torch.no_grad():
+        tokens, scores = searcher(input_batch, lengths, max_length)
+    tokens = tokens.t().tolist()
+    for row, i in enumerate(order):
+        results[i] = [voc.index2word[token] for token in tokens[row]]
+    return results
+
+
+def wordsToReply(output_words):
+    # 去掉EOS后面的内容
+    if output_words != -1:
+        words = []
+        for word in output_words:
+            if word == 'EOS':
+                break
+            elif word != 'PAD':
+                words.append(word)
+        # print('Alice:', ' '.join(words))
+        return ' '.join(words)
+    else:
+        return 'At your service.'
+
+
+def evaluateInputBatch(encoder, decoder, voc, input_sens):
+    # 多个会话的待回复句子一起生成回复，返回和 input_sens 一一对应的字符串
+    input_sentences = [normalizeString(input_sentence) for input_sentence in input_sens]
+    return [wordsToReply(output_words) for output_words in evaluateBatch(encoder, decoder, voc, input_sentences)]
+
+
+def evaluateInput(encoder, decoder, searcher, voc, input_sen, beam_size=1):
+    # beam_size > 1 时改用 BeamSearchDecoder 解码
+    if beam_size > 1:
+        searcher = BeamSearchDecoder(encoder, decoder, beam_size)
     input_sentence = ''
     try:
         # 得到用户终端的输入
@@ -426,47 +327,30 @@ def evaluateInput(encoder, decoder, searcher, voc, input_sen):
         # 生成响应Evaluate sentence
         output_words = evaluate(encoder, decoder, searcher, voc, input_sentence)
         #print(output_words)
-        # 去掉EOS后面的内容
-        if output_words != -1:
-            words = []
-            for word in output_words:
-                if word == 'EOS':
-                    break
-                elif word != 'PAD':
-                    words.append(word)
-            # print('Alice:', ' '.join(words))
-            return ' '.join(words)
-        else:
-            return 'At your service.'
+        return wordsToReply(output_words)
 
     except KeyError:
         print("Error: Encountered unknown word.")
 
-embedding = nn.Embedding(voc.num_words, hidden_size)
-if loadFilename:
-    embedding.load_state_dict(embedding_sd)
-# Initialize encoder & decoder models
-encoder = EncoderRNN(hidden_size, embedding, encoder_n_layers, dropout)
-decoder = LuongAttnDecoderRNN(attn_model, embedding, hidden_size, voc.num_words, decoder_n_layers, dropout)
-if loadFilename:
-    encoder.load_state_dict(encoder_sd)
-    decoder.load_state_dict(decoder_sd)
-# Use appropriate device
-encoder = encoder.to(device)
-decoder = decoder.to(device)
-
-# 进入eval模式，从而去掉dropout。
-encoder.eval()
-decoder.eval()
-
-# 构造searcher对象
-searcher = GreedySearchDecoder(encoder, decoder)
-
-with open('C:\\Users\\86138\\Desktop\\Chatbot\\final_code_nn\\'+'traindata.json', 'r') as f:
-    TrainArray = json.load(f)
+TRAIN_FILE = 'C:\\Users\\86138\\Desktop\\Chatbot\\final_code_nn\\' + 'traindata.json'
 
 FILE = 'C:\\Users\\86138\\Desktop\\Chatbot\\final_code_nn\\' + "data.pth"
-data = torch.load(FILE)
+# export_bundle.py 导出的单文件推理 bundle，存在时优先使用，按内存映射加载
+BUNDLE_FILE = 'C:\\Users\\86138\\Desktop\\Chatbot\\final_code_nn\\' + "bundle.pt"
+
+
+def unpack_words(packed):
+    # bundle 里的词表是用 '\n' 连接后的 uint8 数组
+    return bytes(packed.numpy()).decode('utf-8').split('\n')
+
+
+if os.path.exists(BUNDLE_FILE):
+    bundle = torch.load(BUNDLE_FILE, map_location=torch.device('cpu'), mmap=True, weights_only=True)
+    data = dict(bundle["intent"])
+    data['words'] = unpack_words(data['words'])
+else:
+    bundle = None
+    data = torch.load(FILE)
 
 input_size = data["input_size"]
 hidden_size = data["hidden_size"]
@@ -477,83 +361,151 @@ tags = data['tags']
 model_state = data["model_state"]
 
 
-class ChatNN(nn.Module):
-    # 需要自己写初始化和forward函数
-    def __init__(self, input_size, hidden_size, output_size):
-        super(ChatNN, self).__init__()   # 默认要加这一行，调用父类的初始化操作
-        self.linear0 = nn.Linear(input_size, hidden_size)
-        self.linear1 = nn.Linear(hidden_size, hidden_size)
-        self.linear2 = nn.Linear(hidden_size, output_size)
-        self.relu = nn.ReLU()
-
-    def forward(self, input_x):
-        # 拼写检查要注意
-        output_mid = self.linear0(input_x)
-        output_mid = self.relu(output_mid)
-        output_mid = self.linear1(output_mid)
-        output_mid = self.relu(output_mid)
-        output_mid = self.linear1(output_mid)
-        output_mid = self.relu(output_mid)
-        output_mid = self.linear1(output_mid)
-        output_mid = self.relu(output_mid)
-        output_final = self.linear2(output_mid)
-        return output_final
-
-
-chatnn = ChatNN(input_size, hidden_size, output_size).to(device)
-chatnn.load_state_dict(model_state)
+def load_responses():
+    # 把 traindata.json 编译成和 tags 下标对齐的回复数组
+    # 分类得到的 output 下标可以直接取到回复，不用再线性扫描 TrainArray
+    if bundle is not None:
+        # bundle 里已经按 tags 下标排好了，不再跟踪 traindata.json
+        return None, bundle["intent"]["responses"], None
+    mtime = os.stat(TRAIN_FILE).st_mtime
+    with open(TRAIN_FILE, 'r') as f:
+        train_array = json.load(f)
+    tag_responses = {}
+    for i in train_array['traindata']:
+        tag_responses.setdefault(i['tag'], i['responses'])
+    responses = [tag_responses.get(tag, []) for tag in tags]
+    return train_array, responses, mtime
+
+
+TrainArray, tag_responses, responses_mtime = load_responses()
+
+
+def get_responses(index):
+    # traindata.json 有改动时重新编译，整体替换引用，读者不会看到一半新一半旧的索引
+    global TrainArray, tag_responses, responses_mtime
+    if responses_mtime is not None and os.stat(TRAIN_FILE).st_mtime != responses_mtime:
+        TrainArray, tag_responses, responses_mtime = load_responses()
+    return tag_responses[index]
+
+
+# 先用 assign=True 直接接管 model_state 里（可能是内存映射的）张量，再移到 device 上；CPU 上 .to 不会复制
+chatnn = ChatNN(input_size, hidden_size, output_size)
+chatnn.load_state_dict(model_state, assign=True)
+chatnn = chatnn.to(device)
 chatnn.eval()
 
 
-def trans_to_num(sen):
+# 意图分类的置信度超过这个值才用模板回复，否则交给 seq2seq；可以用 sweep.py 的结果来选
+CONFIDENCE_THRESHOLD = 0.80
+
+
+# 加载时预先建立 单词 -> 列号 的哈希索引，特征化时只需处理句子里的单词，
+# 不再每次遍历整个词表 (O(V*n) -> O(n))
+word_index = {w: index for index, w in enumerate(words)}
+weight_array = numpy.asarray(words_weight, dtype=numpy.float32)
+
+
+def sen_to_cols(sen):
+    # 句子中出现在词表里的单词对应的列号（去重）
+    return numpy.fromiter({word_index[w] for w in sen if w in word_index}, dtype=numpy.int64)
+
+
+def trans_to_num(sen, sparse=False):
     # 这里的sentence已经是处理后的单词数组
+    # sparse=True 时返回 torch 的稀疏向量，否则返回 numpy 的稠密向量
+    cols = sen_to_cols(sen)
+    if sparse:
+        return torch.sparse_coo_tensor(torch.from_numpy(cols).unsqueeze(0),
+                                       torch.from_numpy(weight_array[cols]),
+                                       size=(len(words),))
     num_tmp = numpy.zeros(shape=len(words), dtype=numpy.float32)
-    # numpy的数据格式有严格要求，此处先初始化
-    for index in range(len(words)):
-        if words[index] in sen:
-            num_tmp[index] = words_weight[index]
+    num_tmp[cols] = weight_array[cols]
+    return num_tmp
+
+
+def trans_to_matrix(sens):
+    # 一次把 N 个句子特征化成 (N, V) 的矩阵，每个句子只散布自己的单词
+    num_tmp = numpy.zeros(shape=(len(sens), len(words)), dtype=numpy.float32)
+    for row, sen in enumerate(sens):
+        cols = sen_to_cols(sen)
+        num_tmp[row, cols] = weight_array[cols]
     return num_tmp
 
 
+def classify_batch(sentences, k=3):
+    # 批量意图分类：N 句话只做一次 ChatNN 的 forward
+    # 每一行返回 tag、概率以及前 k 个候选 [(tag, prob), ...]
+    if not sentences:
+        return []
+    sens = [nltk.word_tokenize(sentence.lower()) for sentence in sentences]
+    X = torch.from_numpy(trans_to_matrix(sens)).to(device)
+    with torch.no_grad():
+        output = chatnn(X)
+    ProbsVector = torch.softmax(output, dim=1)
+    top_probs, top_index = torch.topk(ProbsVector, min(k, len(tags)), dim=1)
+    top_probs = top_probs.tolist()
+    top_index = top_index.tolist()
+    results = []
+    for row in range(len(sentences)):
+        top = [(tags[index], prob) for index, prob in zip(top_index[row], top_probs[row])]
+        results.append({
+            "index": top_index[row][0],
+            "tag": top[0][0],
+            "prob": top[0][1],
+            "top": top
+        })
+    return results
+
+
 print("Alice: Hello!")
 
 
 # while True:
 def getreply(your_sentence):
+    return getreply_detail(your_sentence)[0]
+
+
+def getreply_detail(your_sentence):
+    # 返回 (回复, 意图 tag, 置信度)，聊天记录里会一起保存；走 seq2seq 兜底时 tag 是 None
     # print('User: ' + your_sentence)
     # print(1)
     # your_sentence = input()
     # print(your_sentence)
     your_sentence = your_sentence.lower()
-    sentence = nltk.word_tokenize(your_sentence)
-    # print(2)
-    X = trans_to_num(sentence)
-    X = X.reshape(1, X.shape[0])
-    X = torch.from_numpy(X).to(device)
-    # print(3)
-    output = chatnn(X)
-    tmp, index = torch.max(output, dim=1)
-    index = index.item()
-
-    tag = tags[index]
-    # print(4)
-    ProbsVector = torch.softmax(output, dim=1)
-    # print(5)
-    # print(output)
-    # print(probs)
-    # print(probs[0])
-    prob = ProbsVector[0][index].item() # 先取[0]
+    result = classify_batch([your_sentence])[0]
+    prob = result["prob"]
     print(prob)
     # return  evaluateInput(encoder, decoder, searcher, voc, your_sentence)
-    if prob > 0.80:
+    if prob > CONFIDENCE_THRESHOLD:
         print(222)
-        for i in TrainArray['traindata']:
-            if tag == i["tag"]:
-                # print("Alice: ", random.choice(i['responses']))
-                return random.choice(i['responses'])
+        responses = get_responses(result["index"])
+        if responses:
+            # print("Alice: ", random.choice(responses))
+            return random.choice(responses), result["tag"], prob
+        return None, result["tag"], prob
     else:
         #print(your_sentence)
-        return evaluateInput(encoder, decoder, searcher, voc, your_sentence)
+        encoder, decoder, searcher, voc = load_seq2seq()
+        return evaluateInput(encoder, decoder, searcher, voc, your_sentence), None, prob
+
+def getreply_batch(sentences):
+    # 多个会话同时发来的消息一起回复：意图分类一次 forward，置信度不够的再一起走 seq2seq
+    sentences = [sentence.lower() for sentence in sentences]
+    replies = [None] * len(sentences)
+    fallback = []
+    for i, result in enumerate(classify_batch(sentences)):
+        if result["prob"] > CONFIDENCE_THRESHOLD:
+            responses = get_responses(result["index"])
+            if responses:
+                replies[i] = random.choice(responses)
+        else:
+            fallback.append(i)
+    if fallback:
+        encoder, decoder, searcher, voc = load_seq2seq()
+        fallback_replies = evaluateInputBatch(encoder, decoder, voc, [sentences[i] for i in fallback])
+        for i, reply in zip(fallback, fallback_replies):
+            replies[i] = reply
+    return replies
 
 if __name__ == '__main__':
     message = 'Hello'
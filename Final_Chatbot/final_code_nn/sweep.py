@@ -0,0 +1,218 @@
+# 意图分类模型的超参数搜索：多个进程并行训练不同配置的 ChatNN（每个进程只用一个 torch 线程），
+# 在按 tag 分层留出的句子上评估准确率和不同置信度阈值下的覆盖率和准确率；
+# 训练全部结束后再在主进程里单线程测量每种网络大小的单句推理耗时
+# 用法：在 final_code_nn 目录下运行 python sweep.py [进程数]
+# 词表、词性权重和 tags 取自 data.pth，句子按 nn_main 推理时的方式特征化
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import nltk
+import numpy
+import torch
+import torch.nn as nn
+
+from models import ChatNN
+
+FILE = "data.pth"
+TRAIN_FILE = "traindata.json"
+RESULT_FILE = "sweep_results.json"
+
+# 搜索的网格
+HIDDEN_SIZES = [8, 16, 32, 64]
+LEARNING_RATES = [0.001, 0.01]
+EPOCHS = [500, 2000]
+BATCH_SIZES = [None, 8]         # None 表示整个训练集作为一个 batch
+THRESHOLDS = [0.5, 0.7, 0.8, 0.9]  # nn_main 里 CONFIDENCE_THRESHOLD 的候选
+SEEDS = [0, 1, 2]               # 每个配置换几种划分重复训练，结果取平均
+VAL_FRACTION = 0.25             # 每个 tag 留出的比例，至少两句的 tag 至少留一句
+LATENCY_REPEAT = 200
+LATENCY_ROUNDS = 5
+
+
+def load_dataset():
+    # 返回 (特征矩阵, 标签, tags)
+    data = torch.load(FILE, map_location=torch.device('cpu'))
+    words = data['words']
+    tags = data['tags']
+    word_index = {w: index for index, w in enumerate(words)}
+    weight_array = numpy.asarray(data['words_weight'], dtype=numpy.float32)
+    tag_index = {}
+    for index, tag in enumerate(tags):
+        tag_index.setdefault(tag, index)
+    with open(TRAIN_FILE, 'r') as f:
+        train_array = json.load(f)
+    sens = []
+    labels = []
+    for i in train_array['traindata']:
+        if i['tag'] not in tag_index:
+            continue
+        for input_sentence in i['input_sen']:
+            sens.append(nltk.word_tokenize(input_sentence.lower()))
+            labels.append(tag_index[i['tag']])
+    x = numpy.zeros(shape=(len(sens), len(words)), dtype=numpy.float32)
+    for row, sen in enumerate(sens):
+        cols = numpy.fromiter({word_index[w] for w in sen if w in word_index}, dtype=numpy.int64)
+        x[row, cols] = weight_array[cols]
+    return x, numpy.array(labels, dtype=numpy.int64), tags
+
+
+def split_dataset(y, seed):
+    # 按 tag 分层划分，只有一句的 tag 全部用来训练
+    rng = numpy.random.default_rng(seed)
+    train_index = []
+    val_index = []
+    for tag_num in numpy.unique(y):
+        index = rng.permutation(numpy.flatnonzero(y == tag_num))
+        val_num = int(len(index) * VAL_FRACTION)
+        if val_num == 0 and len(index) >= 2:
+            val_num = 1
+        val_index.extend(index[:val_num])
+        train_index.extend(index[val_num:])
+    return numpy.array(train_index), numpy.array(val_index)
+
+
+# 每个工作进程只在启动时收到一次数据集
+dataset = None
+
+
+def init_worker(x, y, output_size):
+    global dataset
+    torch.set_num_threads(1)
+    dataset = (torch.from_numpy(x), torch.from_numpy(y), output_size)
+
+
+def run_config(config):
+    # 训练并评估一个 (配置, 划分种子)
+    x, y, output_size = dataset
+    torch.manual_seed(config["seed"])
+    train_index, val_index = split_dataset(y.numpy(), config["seed"])
+    train_x, train_y = x[train_index], y[train_index]
+    val_x, val_y = x[val_index], y[val_index]
+
+    chatnn = ChatNN(x.size(1), config["hidden_size"], output_size)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(chatnn.parameters(), lr=config["lr"])
+    train_num = len(train_y)
+    step = train_num if config["batch_size"] is None else config["batch_size"]
+    start = time.perf_counter()
+    for cnt in range(config["epochs"]):
+        order = torch.randperm(train_num)
+        for begin in range(0, train_num, step):
+            batch = order[begin:begin + step]
+            loss = criterion(chatnn(train_x[batch]), train_y[batch])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+    train_time = time.perf_counter() - start
+
+    chatnn.eval()
+    with torch.no_grad():
+        probs = torch.softmax(chatnn(val_x), dim=1)
+        prob, predict = probs.max(dim=1)
+        correct = predict == val_y
+
+    thresholds = {}
+    for threshold in THRESHOLDS:
+        confident = prob > threshold
+        # 覆盖率：置信度超过阈值、直接用模板回复的比例；其余的交给 seq2seq
+        thresholds[str(threshold)] = {
+            "coverage": confident.float().mean().item(),
+            "accuracy": correct[confident].float().mean().item() if confident.any() else None
+        }
+    return dict(config, accuracy=correct.float().mean().item(),
+                train_time=train_time, thresholds=thresholds)
+
+
+def measure_latency(x, output_size):
+    # 单句推理耗时只取决于网络结构，和训练出来的参数无关，所以每个 hidden_size 量一次；
+    # 在所有训练进程结束后在主进程里单线程测，不会被同时训练的其他进程拖慢。
+    # 几种大小轮流测几轮取最快的一轮，避免先测的那个吃掉预热的开销
+    models = {hidden_size: ChatNN(x.size(1), hidden_size, output_size).eval() for hidden_size in HIDDEN_SIZES}
+    # 和 getreply 一样一次只分类一句话
+    sample = x[:1]
+    latencies = {hidden_size: float('inf') for hidden_size in HIDDEN_SIZES}
+    with torch.no_grad():
+        for _ in range(LATENCY_ROUNDS):
+            for hidden_size, chatnn in models.items():
+                for _ in range(10):
+                    chatnn(sample)
+                start = time.perf_counter()
+                for _ in range(LATENCY_REPEAT):
+                    chatnn(sample)
+                latency = (time.perf_counter() - start) / LATENCY_REPEAT * 1e6
+                latencies[hidden_size] = min(latencies[hidden_size], latency)
+    return latencies
+
+
+def summarize(results):
+    # 同一配置的几次结果取平均
+    groups = {}
+    for result in results:
+        key = (result["hidden_size"], result["lr"], result["epochs"], result["batch_size"])
+        groups.setdefault(key, []).append(result)
+    summary = []
+    for (hidden_size, lr, epochs, batch_size), runs in groups.items():
+        thresholds = {}
+        for threshold in THRESHOLDS:
+            runs_threshold = [run["thresholds"][str(threshold)] for run in runs]
+            accuracies = [t["accuracy"] for t in runs_threshold if t["accuracy"] is not None]
+            thresholds[str(threshold)] = {
+                "coverage": numpy.mean([t["coverage"] for t in runs_threshold]),
+                "accuracy": numpy.mean(accuracies) if accuracies else None
+            }
+        summary.append({
+            "hidden_size": hidden_size, "lr": lr, "epochs": epochs, "batch_size": batch_size,
+            "accuracy": numpy.mean([run["accuracy"] for run in runs]),
+            "latency_us": runs[0]["latency_us"],
+            "train_time": numpy.mean([run["train_time"] for run in runs]),
+            "thresholds": thresholds
+        })
+    # 准确率 / 推理耗时的前沿：没有别的配置既更准又更快
+    for row in summary:
+        row["frontier"] = not any(other["accuracy"] >= row["accuracy"] and other["latency_us"] < row["latency_us"]
+                                  or other["accuracy"] > row["accuracy"] and other["latency_us"] <= row["latency_us"]
+                                  for other in summary)
+    summary.sort(key=lambda row: (-row["accuracy"], row["latency_us"]))
+    return summary
+
+
+def print_summary(summary):
+    print("{:>6} {:>6} {:>6} {:>5} {:>8} {:>10} {:>8}  {}".format(
+        "hidden", "lr", "epochs", "batch", "accuracy", "latency/us", "train/s",
+        "  ".join("@{}: cov/acc".format(threshold) for threshold in THRESHOLDS)))
+    for row in summary:
+        cells = []
+        for threshold in THRESHOLDS:
+            t = row["thresholds"][str(threshold)]
+            cells.append("{:.2f}/{}".format(t["coverage"], "-" if t["accuracy"] is None else "{:.2f}".format(t["accuracy"])))
+        print("{:>6} {:>6} {:>6} {:>5} {:>8.3f} {:>10.1f} {:>8.2f}  {}{}".format(
+            row["hidden_size"], row["lr"], row["epochs"], "full" if row["batch_size"] is None else row["batch_size"],
+            row["accuracy"], row["latency_us"], row["train_time"], "  ".join(cells),
+            "  *" if row["frontier"] else ""))
+    print("* accuracy/latency frontier")
+
+
+if __name__ == '__main__':
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    x, y, tags = load_dataset()
+    configs = [{"hidden_size": hidden_size, "lr": lr, "epochs": epochs, "batch_size": batch_size, "seed": seed}
+               for hidden_size, lr, epochs, batch_size, seed
+               in itertools.product(HIDDEN_SIZES, LEARNING_RATES, EPOCHS, BATCH_SIZES, SEEDS)]
+    print("{} sentences, {} tags, {} runs on {} processes".format(len(y), len(tags), len(configs), processes))
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_worker,
+                             initargs=(x, y, len(tags))) as executor:
+        results = list(executor.map(run_config, configs))
+    print("Finished in {:.1f} s".format(time.perf_counter() - start))
+    torch.set_num_threads(1)
+    latencies = measure_latency(torch.from_numpy(x), len(tags))
+    for result in results:
+        result["latency_us"] = latencies[result["hidden_size"]]
+    summary = summarize(results)
+    print_summary(summary)
+    with open(RESULT_FILE, 'w') as f:
+        json.dump({"runs": results, "summary": summary}, f, indent=2)
@@ -0,0 +1,32 @@
+# 训练数据预处理结果的缓存，final_code_nn/FNN_train.py 和 finalnn/train.py 共用
+# 按 traindata.json 的内容和预处理配置做哈希，两者都没变时直接读 npz，不用再跑 nltk
+import hashlib
+import json
+import os
+
+import numpy
+
+
+def cache_file(cache_dir, train_bytes, config):
+    key = hashlib.sha256(train_bytes + json.dumps(config, sort_keys=True).encode('utf-8'))
+    return os.path.join(cache_dir, key.hexdigest() + '.npz')
+
+
+def load_cache(path, names):
+    # 命中时返回 (meta, [names 对应的数组])，文件不存在或者损坏时返回 None
+    if not os.path.exists(path):
+        return None
+    try:
+        with numpy.load(path, allow_pickle=False) as cache:
+            return json.loads(str(cache['meta'])), [cache[name] for name in names]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_cache(path, meta, arrays):
+    # meta 是可以转成 JSON 的词表等信息，arrays 是 {名字: numpy 数组}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 先写临时文件再替换，中途退出不会留下半个缓存
+    tmp = path + '.tmp.npz'
+    numpy.savez(tmp, meta=numpy.array(json.dumps(meta)), **arrays)
+    os.replace(tmp, path)
@@ -1,14 +1,14 @@
 import torch
 import random
 import json
+import os
 import nltk
 import numpy
 import torch.nn as nn
 
 device = torch.device('cpu')
 
-with open(r'C:\Users\86138\Desktop\Chatbot\finalnn\traindata.json', 'r') as f:
-    TrainArray = json.load(f)
+TRAIN_FILE = r'C:\Users\86138\Desktop\Chatbot\finalnn\traindata.json'
 
 FILE = r"C:\Users\86138\Desktop\Chatbot\finalnn\data.pth"
 data = torch.load(FILE)
@@ -21,6 +21,29 @@ tags = data['tags']
 model_state = data["model_state"]
 
 
+def load_responses():
+    # 把 traindata.json 编译成和 tags 下标对齐的回复数组，回复时不再线性扫描
+    mtime = os.stat(TRAIN_FILE).st_mtime
+    with open(TRAIN_FILE, 'r') as f:
+        train_array = json.load(f)
+    tag_responses = {}
+    for i in train_array['traindata']:
+        tag_responses.setdefault(i['tag'], i['responses'])
+    responses = [tag_responses.get(tag, []) for tag in tags]
+    return train_array, responses, mtime
+
+
+TrainArray, tag_responses, responses_mtime = load_responses()
+
+
+def get_responses(index):
+    # traindata.json 有改动时重新编译，整体替换引用
+    global TrainArray, tag_responses, responses_mtime
+    if os.stat(TRAIN_FILE).st_mtime != responses_mtime:
+        TrainArray, tag_responses, responses_mtime = load_responses()
+    return tag_responses[index]
+
+
 class ChatNN(nn.Module):
     # 需要自己写初始化和forward函数
     def __init__(self, input_size, hidden_size, output_size):
@@ -49,13 +72,17 @@ chatnn.load_state_dict(model_state)
 chatnn.eval()
 
 
+# 预先建立 单词 -> 列号 的哈希索引，特征化时只处理句子里的单词
+word_index = {w: index for index, w in enumerate(words)}
+
+
 def trans_to_num(sen):
     # 这里的sentence已经是处理后的单词数组
     num_tmp = numpy.zeros(shape=len(words), dtype=numpy.float32)
     # numpy的数据格式有严格要求，此处先初始化
-    for index in range(len(words)):
-        if words[index] in sen:
-            num_tmp[index] = 1
+    for w in sen:
+        if w in word_index:
+            num_tmp[word_index[w]] = 1
     return num_tmp
 
 
@@ -72,18 +99,16 @@ def GetReply(message):  # 根据用户发送的消息获取回答
     output = chatnn(X)
     _, predicted = torch.max(output, dim=1)
 
-    tag = tags[predicted.item()]
-
     probs = torch.softmax(output, dim=1)
     # print(output)
     # print(probs)
     # print(probs[0])
     prob = probs[0][predicted.item()]
     if prob.item() > 0.80:
-        for i in TrainArray['traindata']:
-            if tag == i["tag"]:
-                # print(f"{bot_name}: {random.choice(i['responses'])}")
-                return random.choice(i['responses'])
+        responses = get_responses(predicted.item())
+        if responses:
+            # print(f"{bot_name}: {random.choice(responses)}")
+            return random.choice(responses)
     else:
         # print(f"{bot_name}: I do not understand...")
         reply = "I do not understand..."
@@ -4,8 +4,14 @@ import torch.nn as nn
 import numpy
 import nltk
 import json
+import os
+import sys
 from torch.utils.data import Dataset, DataLoader
 
+# 预处理缓存和 final_code_nn/FNN_train.py 共用 final_code_nn/train_cache.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from final_code_nn.train_cache import cache_file, load_cache, save_cache
+
 
 class ChatNN(nn.Module):
     # 需要自己写初始化和forward函数
@@ -30,8 +36,23 @@ class ChatNN(nn.Module):
         return output_final
 
 
-with open(r'C:\Users\86138\Desktop\Chatbot\finalnn\traindata.json', 'r') as f:
-    TrainArray = json.load(f)
+# 标点和不文明单词，分词时去掉
+SKIP_WORDS = {',', ';', ':'}
+DIRTY_WORDS = {'fuck', 'bitch', 'sb'}
+
+# 预处理的结果按 traindata.json 的内容和下面的配置做哈希缓存，只改超参数时不用再跑 nltk
+# 修改 trans_to_words / trans_to_num 的逻辑时要把 version 加一
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'preprocess_cache')
+PREPROCESS_CONFIG = {
+    "version": 1,
+    "skip_words": sorted(SKIP_WORDS),
+    "dirty_words": sorted(DIRTY_WORDS),
+    "nltk": nltk.__version__
+}
+
+with open(r'C:\Users\86138\Desktop\Chatbot\finalnn\traindata.json', 'rb') as f:
+    TrainBytes = f.read()
+TrainArray = json.loads(TrainBytes)
 
 
 def trans_to_words(sen):
@@ -42,10 +63,10 @@ def trans_to_words(sen):
     # print(word_array)
     for s_word in word_array:
         s_word = s_word.lower()
-        if s_word == ',' or s_word == ';' or s_word == ':':
+        if s_word in SKIP_WORDS:
             # 无需考虑 ，但是要考虑 .?!
             continue
-        if s_word == 'fuck' or s_word == 'bitch' or s_word == 'sb':
+        if s_word in DIRTY_WORDS:
             # 处理 dirty words
             continue
         words_tmp.append(s_word)
@@ -53,25 +74,6 @@ def trans_to_words(sen):
     return words_tmp
 
 
-tags = []
-words = []
-sentence_tag = []  # 句子与标签的一一对应，是个元组的数组，但是其中的句子实际上是单词数组
-train_input = []
-train_output = []
-
-for i in TrainArray['traindata']:
-    tag = i['tag']
-    tags.append(tag)
-    for input_sentence in i['input_sen']:
-        # print(input_sentence)
-        tmp = trans_to_words(input_sentence)
-        # print(tmp)
-        words.extend(tmp)
-        sentence_tag.append((tmp, tag))
-
-words = sorted(set(words))  # 只用一个set就不可以
-
-
 def trans_to_num(sen):
     # 这里的sentence已经是处理后的单词数组
     num_tmp = numpy.zeros(shape=len(words), dtype=numpy.float32)
@@ -82,16 +84,44 @@ def trans_to_num(sen):
     return num_tmp
 
 
-# 将输入输出转换为数字
-for (sentence, tag) in sentence_tag:
-    # 这里的sentence实际上已经是处理后得到的单词数组
-    sen_num = trans_to_num(sentence)
-    train_input.append(sen_num)
-    tag_num = tags.index(tag)
-    train_output.append(tag_num)
-
-train_input = numpy.array(train_input)
-train_output = numpy.array(train_output)
+CACHE_FILE = cache_file(CACHE_DIR, TrainBytes, PREPROCESS_CONFIG)
+cache = load_cache(CACHE_FILE, ['train_input', 'train_output'])
+if cache is not None:
+    print("Loaded preprocessed data from", CACHE_FILE)
+    meta, (train_input, train_output) = cache
+    tags, words = meta['tags'], meta['words']
+    sentence_tag = [(sentence, tag) for sentence, tag in meta['sentence_tag']]
+else:
+    tags = []
+    words = []
+    sentence_tag = []  # 句子与标签的一一对应，是个元组的数组，但是其中的句子实际上是单词数组
+    train_input = []
+    train_output = []
+
+    for i in TrainArray['traindata']:
+        tag = i['tag']
+        tags.append(tag)
+        for input_sentence in i['input_sen']:
+            # print(input_sentence)
+            tmp = trans_to_words(input_sentence)
+            # print(tmp)
+            words.extend(tmp)
+            sentence_tag.append((tmp, tag))
+
+    words = sorted(set(words))  # 只用一个set就不可以
+
+    # 将输入输出转换为数字
+    for (sentence, tag) in sentence_tag:
+        # 这里的sentence实际上已经是处理后得到的单词数组
+        sen_num = trans_to_num(sentence)
+        train_input.append(sen_num)
+        tag_num = tags.index(tag)
+        train_output.append(tag_num)
+
+    train_input = numpy.array(train_input)
+    train_output = numpy.array(train_output)
+    save_cache(CACHE_FILE, {"tags": tags, "words": words, "sentence_tag": sentence_tag},
+               {"train_input": train_input, "train_output": train_output})
 
 epoch = 10000
 
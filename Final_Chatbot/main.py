@@ -5,22 +5,89 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QToolTip,
                              QDesktopWidget, QLineEdit, QSplitter, QAction, QFrame,
                              QWidget, QTextBrowser, QTextEdit, QLabel, QScrollArea,
                              QMessageBox, qApp, QTextEdit, QStackedLayout, QFileDialog)
-from PyQt5.QtGui import QIcon, QFont, QFontMetrics, QPixmap, QMovie
-from PyQt5.QtCore import Qt, QEvent, QPropertyAnimation, QRect
+from PyQt5.QtGui import QIcon, QFont, QFontMetrics, QPixmap, QImage, QMovie
+from PyQt5.QtCore import (Qt, QEvent, QPropertyAnimation, QRect, QObject, QRunnable,
+                          QThreadPool, pyqtSignal)
 from qt_material import apply_stylesheet
 from finalnn.main import GetReply
 from Audio.main import recording, noise_reduce
 import time
+import traceback
 from GUI.history import HistoryUI
 from pythonProject1.xunfei_test import ws, wsParam, wsUrl, on_message, on_error, on_open
-from pythonProject2.main import voc, evaluateInput, encoder, decoder, searcher
 import torch.nn as nn
 import websocket, ssl
 from Speech.main import speak
 from GUI.open import search_open
+from GUI.chat_view import ChatModel, ChatView, ChatDelegate, loadAvatar, USER, ROBOT
 from pythonProject.main import weather, mytime
-from threading import Thread
-from final_code_nn.nn_main import getreply
+from threading import Thread, Lock
+from final_code_nn.nn_main import getreply, getreply_detail
+from GUI.history_writer import HistoryWriter
+from GUI.history_index import HistoryIndex
+from GUI.history_archive import compact
+
+HISTORY_DIR = 'C:\\Users\\86138\\Desktop\\Chatbot\\History'
+
+
+class ReplySignals(QObject):
+    # (机器人气泡的行号, 回复类型 'text'/'weather'/'time', 回复文本,
+    #  {'tag': 意图, 'confidence': 置信度, 'latency': 生成回复用的毫秒数, 'image': weather/time 的 QImage})
+    finished = pyqtSignal(int, str, str, object)
+
+
+WEATHER_IMAGE = r'C:\Users\86138\Desktop\Chatbot\pythonProject\weather.png'
+TIME_IMAGE = r'C:\Users\86138\Desktop\Chatbot\pythonProject\time_out.png'
+
+# weather() 和 mytime() 都会覆盖同一张图片，同一时刻只让一个线程调用
+# 图片也在持有锁的时候读进 QImage 交给 GUI 线程，避免另一个请求在 GUI 线程读图时改写文件
+skill_lock = Lock()
+
+
+class ReplyWorker(QRunnable):
+    # 在线程池里生成一条回复，结果通过信号交回 GUI 线程
+    def __init__(self, row, message):
+        super().__init__()
+        self.row = row
+        self.message = message
+        self.signals = ReplySignals()
+
+    def run(self):
+        message = self.message
+        kind = 'text'
+        reply = "Image"
+        tag = None
+        confidence = None
+        image = None
+        start = time.perf_counter()
+        try:
+            if search_open(message):
+                reply = 'Opening for you'
+                tag = 'open'
+            elif 'weather' in message.lower():
+                with skill_lock:
+                    weather()
+                    image = QImage(WEATHER_IMAGE)
+                kind = tag = 'weather'
+            elif 'time' in message.lower():
+                with skill_lock:
+                    mytime()
+                    image = QImage(TIME_IMAGE)
+                kind = tag = 'time'
+            else:
+                # reply = evaluateInput(encoder, decoder, searcher, voc, message)
+                reply, tag, confidence = getreply_detail(message)
+                print(reply)
+        except Exception:
+            # 出错也要发信号，否则 "typing..." 气泡会一直留着
+            traceback.print_exc()
+            kind = 'text'
+            reply = None
+        if reply is None:
+            reply = "I do not understand..."
+        info = {"tag": tag, "confidence": confidence,
+                "latency": round((time.perf_counter() - start) * 1000, 1), "image": image}
+        self.signals.finished.emit(self.row, kind, reply, info)
 
 
 class MainUI(QMainWindow):
@@ -31,31 +98,12 @@ class MainUI(QMainWindow):
     # 初始化 UI 界面
     def initUI(self):
 
-        year = time.strftime('%Y', time.localtime(time.time()))
-        month = time.strftime('%m', time.localtime(time.time()))
-        day = time.strftime('%d', time.localtime(time.time()))
-        t = time.strftime('%m%d %H%M%S', time.localtime(time.time()))
-
-        fileYear = 'C:\\Users\\86138\\Desktop\\Chatbot\\History\\' + year
-        fileMonth = fileYear + '/' + month
-        # fileDay = fileMonth + '/' + day
-
-        # self.filename = fileDay
-
-        if not os.path.exists(fileYear):
-            os.mkdir(fileYear)
-            os.mkdir(fileMonth)
-            # os.mkdir(fileDay)
-        else:
-            if not os.path.exists(fileMonth):
-                os.mkdir(fileMonth)
-                # os.mkdir(fileDay)
-            # else:
-            # if not os.path.exists(fileDay):
-            # os.mkdir(fileDay)
-
-        # 创建一个文件，以‘timeFile_’+具体时间为文件名称
-        self.histo_file = fileMonth + '/timeFile_' + str(year) + '_' + str(month) + '_' + str(day) + '.txt'
+        # 聊天记录交给后台线程批量写入 History/<年>/<月>/timeFile_<年>_<月>_<日>.jsonl
+        # 每次写入后顺便更新全文索引，历史记录窗口直接查索引
+        self.history_index = HistoryIndex(HISTORY_DIR)
+        self.history = HistoryWriter(HISTORY_DIR, index=self.history_index)
+        # 30 天以前的每日记录在后台压缩进月度归档
+        Thread(target=compact, args=(HISTORY_DIR,), kwargs={"index": self.history_index}, daemon=True).start()
 
         QToolTip.setFont(QFont('SansSerif', 20))
 
@@ -182,48 +230,37 @@ class MainUI(QMainWindow):
         self.audio_anim2.setVisible(False)
         self.wavegif2.start()
 
-        self.chat_area = QWidget(self.top_frame)
-        self.chat_area.resize(self.top_frame.rect().width() - 5, self.top_frame.rect().height())
-
-        self.Labels = []
-        for i in range(1000):
-            new_label = QLabel("Text", self.chat_area)
-            new_label.setVisible(False)
-            new_label.setAlignment(Qt.AlignCenter)
-            self.Labels.append(new_label)
-
-        self.roboAvatars = []
-        for i in range(1000):
-            new_label = QLabel(self.chat_area)
-            self.Image = QPixmap()
-            self.Image.load('img/Walle.jpeg')
-            self.Image = self.Image.scaled(35, 35)
-            new_label.setPixmap(self.Image)
-            new_label.setVisible(False)
-            self.roboAvatars.append(new_label)
-
-        self.userAvatars = []
-        for i in range(1000):
-            new_label = QLabel(self.chat_area)
-            self.Image = QPixmap()
-            self.Image.load('img/User.jpeg')
-            self.Image = self.Image.scaled(35, 35)
-            new_label.setPixmap(self.Image)
-            new_label.setVisible(False)
-            self.userAvatars.append(new_label)
-
-        self.reply_Labels = []
-        for i in range(1000):
-            new_label = QLabel("Text", self.chat_area)
-            new_label.setVisible(False)
-            new_label.setAlignment(Qt.AlignCenter)
-            self.reply_Labels.append(new_label)
-
-        self.message_pos_y = 0
-
-        self.scroll = QScrollArea(self.top_frame)
-        self.scroll.setWidget(self.chat_area)
-        self.scrollBar = self.scroll.verticalScrollBar()
+        # 聊天记录用 model/view 显示，只绘制可见的气泡，头像只加载一次
+        self.chat_model = ChatModel(self)
+        self.chat_view = ChatView(self.top_frame)
+        self.chat_delegate = ChatDelegate(self.chat_view, loadAvatar('img/User.jpeg'), loadAvatar('img/Walle.jpeg'))
+        self.chat_view.setItemDelegate(self.chat_delegate)
+        self.chat_view.setModel(self.chat_model)
+        self.chat_model.dataChanged.connect(self.chat_delegate.forgetSizes)
+
+        # 控件的位置交给 layout 管理，只在 frame 的大小真正变化时才重新排版，
+        # 不再在每次鼠标移动时挨个移动所有控件
+        top_layout = QVBoxLayout(self.top_frame)
+        top_layout.setContentsMargins(2, 2, 2, 2)
+        top_layout.addWidget(self.chat_view)
+
+        self.btn.setFixedSize(150, 80)
+        self.audio_btn.setFixedSize(150, 80)
+        self.audio_anim1.setFixedSize(148, 125)
+        self.audio_anim2.setFixedSize(148, 125)
+        bottom_layout = QGridLayout(self.bottom_frame)
+        bottom_layout.setContentsMargins(0, 0, 0, 0)
+        bottom_layout.setSpacing(0)
+        bottom_layout.addWidget(self.input, 0, 0, 3, 1)
+        bottom_layout.addWidget(self.audio_btn, 0, 1)
+        # 两个录音动画叠在同一格里，同一时刻只显示一个
+        bottom_layout.addWidget(self.audio_anim1, 1, 1, Qt.AlignCenter)
+        bottom_layout.addWidget(self.audio_anim2, 1, 1, Qt.AlignCenter)
+        bottom_layout.addWidget(self.btn, 2, 1)
+
+        # 回复在线程池里生成，不阻塞 GUI 线程
+        self.reply_pool = QThreadPool.globalInstance()
+        self.pending = {}  # 机器人气泡的行号 -> (发送时间, 用户消息)
 
         splitter.addWidget(self.top_frame)
         splitter.addWidget(self.bottom_frame)
@@ -234,7 +271,7 @@ class MainUI(QMainWindow):
         self.setWindowTitle('Chatbot')
         self.setWindowIcon(QIcon('img/Jarvis.jpeg'))
 
-        self.histo_widget = HistoryUI()
+        self.histo_widget = HistoryUI(index=self.history_index)
         self.lay.addWidget(self.main_widget)
         self.lay.addWidget(self.histo_widget)
 
@@ -246,22 +283,21 @@ class MainUI(QMainWindow):
 
         # print(type(path))
         # print(path)
-
-        for i in range(1000):
-            Image = QPixmap()
-            Image.load(path)
-            Image = Image.scaled(35, 35)
-            self.userAvatars[i].setPixmap(Image)
+        if path:
+            Image = loadAvatar(path)
+            if not Image.isNull():
+                self.chat_delegate.setAvatar(USER, Image)
+                self.chat_view.viewport().update()
 
     def FileOpen2(self):
         path, _ = QFileDialog.getOpenFileName(self, '打开文件', r'C:\Users\86138\Desktop',
                                               '图片文件 (*.jpeg)')
 
-        for i in range(1000):
-            Image = QPixmap()
-            Image.load(path)
-            Image = Image.scaled(35, 35)
-            self.roboAvatars[i].setPixmap(Image)
+        if path:
+            Image = loadAvatar(path)
+            if not Image.isNull():
+                self.chat_delegate.setAvatar(ROBOT, Image)
+                self.chat_view.viewport().update()
         # print(type(path))
         # print(path)
 
@@ -290,173 +326,49 @@ class MainUI(QMainWindow):
         else:
             with open('dark_custom.css') as file:
                 app.setStyleSheet(stylesheet + file.read().format(**os.environ))
+        self.chat_delegate.setTheme('light' in q.text())
+        self.chat_view.viewport().update()
         self.show()
 
-    # 发送消息的动画
+    # 发送消息
+    # 用户的消息立即显示，机器人先显示一个 "typing..." 气泡，回复在线程池里生成，完成后通过信号回到 GUI 线程
     def DoAnim(self):
         self.entry_cnt += 1
 
         message = self.input.toPlainText()
-
-        with open(self.histo_file, 'a') as f:
-            wirte_in = "User: " + message + "\n"
-            t = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))
-            f.write(str(t) + "\n")
-            f.write(wirte_in)
-
-        f.close()
-
-        self.Labels[self.entry_cnt - 1].setText(message)
-        self.Labels[self.entry_cnt - 1].setVisible(True)
-        self.Labels[self.entry_cnt - 1].adjustSize()
-        self.Labels[self.entry_cnt - 1].resize(self.Labels[self.entry_cnt - 1].rect().width() + 25, \
-                                               self.Labels[self.entry_cnt - 1].rect().height() + 25)
-
         # lines = self.input.document().lineCount()
         self.input.clear()
 
-        self.anim = QPropertyAnimation(self.Labels[self.entry_cnt - 1], b"geometry")
-        self.anim.setDuration(100)
-
-        self.message_pos_y += (self.Labels[self.entry_cnt - 1].rect().height() + 10)
-
-        if self.message_pos_y > self.chat_area.rect().height():
-            self.chat_area.resize(self.chat_area.rect().width(), self.chat_area.rect().height() \
-                                  + self.Labels[self.entry_cnt - 1].rect().height() + 10)
-
-        width = self.chat_area.rect().width()
-        height = self.chat_area.rect().height()
-
-        self.userAvatars[self.entry_cnt - 1].setVisible(True)
-        self.userAvatars[self.entry_cnt - 1].setGeometry(width - 45,
-                                                         self.message_pos_y - self.Labels[
-                                                             self.entry_cnt - 1].rect().height() - 5, \
-                                                         35, 35)
-
-        self.anim.setStartValue(QRect(width, height, 0, 0))
-
-        self.anim.setEndValue(QRect(width - self.Labels[self.entry_cnt - 1].rect().width() - 50, \
-                                    self.message_pos_y - self.Labels[self.entry_cnt - 1].rect().height(), \
-                                    self.Labels[self.entry_cnt - 1].rect().width(), \
-                                    self.Labels[self.entry_cnt - 1].rect().height()))
-
-        self.anim.start()
-        self.scrollBar.setValue(self.chat_area.rect().height())
-        # print(1)
-        # self.show()
-
-        img_flag = False # 表示机器人的回复是不是一张图片
-        reply = "Image"
-
-        if search_open(message):
-            reply = 'Opening for you'
-        elif 'weather' in message.lower():
-            print(2)
-            weather()
-            print(3)
-            img_flag = True
-            Image1 = QPixmap()
-            Image1.load(r'C:\Users\86138\Desktop\Chatbot\pythonProject\weather.png')
-            Image1 = Image1.scaled(200, 75)
-            print(1)
-            self.reply_Labels[self.entry_cnt - 1].setPixmap(Image1)
-            # self.reply_Labels[self.entry_cnt - 1].setVisible(True)
-            self.reply_Labels[self.entry_cnt - 1].resize(200, 75)
-
-        elif 'time' in message.lower():
-            mytime()
-            img_flag = True
-            Image1 = QPixmap()
-            Image1.load(r'C:\Users\86138\Desktop\Chatbot\pythonProject\time_out.png')
-            Image1 = Image1.scaled(330, 270)
-            print(1)
-            self.reply_Labels[self.entry_cnt - 1].setPixmap(Image1)
-            self.reply_Labels[self.entry_cnt - 1].resize(330, 270)
+        self.chat_model.addMessage(USER, message)
+        # 回复还没生成，先放一个 "typing..." 的占位气泡
+        row = self.chat_model.addMessage(ROBOT, "typing...")
+        self.pending[row] = (time.localtime(time.time()), message)
+        self.chat_view.scrollToBottom()
+
+        worker = ReplyWorker(row, message)
+        worker.signals.finished.connect(self.onReply)
+        self.reply_pool.start(worker)
+
+    # 回复生成完成，在 GUI 线程里把占位气泡换成真正的回复
+    def onReply(self, row, kind, reply, info):
+        if kind == 'weather':
+            Image1 = QPixmap.fromImage(info["image"])
+            self.chat_model.setMessage(row, reply, Image1.scaled(200, 75))
+        elif kind == 'time':
+            Image1 = QPixmap.fromImage(info["image"])
+            self.chat_model.setMessage(row, reply, Image1.scaled(330, 270))
         else:
-            # reply = evaluateInput(encoder, decoder, searcher, voc, message)
-            reply = getreply(message)
-            print(reply)
-
-        with open(self.histo_file, 'a') as f:
-            wirte_in = "Robot: " + reply + "\n\n"
-            f.write(wirte_in)
-
-        f.close()
-
-        self.message_pos_y += (self.reply_Labels[self.entry_cnt - 1].rect().height() + 10)
-
-        if self.message_pos_y > self.chat_area.rect().height():
-            self.chat_area.resize(self.chat_area.rect().width(), self.chat_area.rect().height() \
-                                      + self.reply_Labels[self.entry_cnt - 1].rect().height() + 10)
-
-        width = self.chat_area.rect().width()
-        height = self.chat_area.rect().height()
-
-        self.roboAvatars[self.entry_cnt - 1].setVisible(True)
-        self.roboAvatars[self.entry_cnt - 1].setGeometry(0,
-                                                         self.message_pos_y - self.reply_Labels[self.entry_cnt - 1].rect().height() - 5,
-                                                         35, 35)
-
-        if not img_flag:
-            print(55)
-            self.reply_Labels[self.entry_cnt - 1].setText(reply)
-            self.reply_Labels[self.entry_cnt - 1].setVisible(True)
-            self.reply_Labels[self.entry_cnt - 1].adjustSize()
-            self.reply_Labels[self.entry_cnt - 1].resize(self.reply_Labels[self.entry_cnt - 1].rect().width() + 25, \
-                                                         self.reply_Labels[self.entry_cnt - 1].rect().height() + 25)
+            self.chat_model.setMessage(row, reply)
 
-            # 回复对话框的动画
+        # 用户消息和回复一起记录，多条消息同时在处理时历史记录也不会交错；这里只入队，不做 I/O
+        send_time, message = self.pending.pop(row)
+        self.history.write('User', message, t=send_time)
+        self.history.write('Robot', reply, tag=info["tag"], confidence=info["confidence"],
+                           latency=info["latency"], t=send_time)
 
-            self.anim2 = QPropertyAnimation(self.reply_Labels[self.entry_cnt - 1], b"geometry")
-            self.anim2.setDuration(100)
-
-            self.anim2.setStartValue(QRect(25, height, 0, 0))
-
-            self.anim2.setEndValue(QRect(40, self.message_pos_y - self.reply_Labels[self.entry_cnt - 1].rect().height(),
-                                         self.reply_Labels[self.entry_cnt - 1].rect().width(),
-                                         self.reply_Labels[self.entry_cnt - 1].rect().height()))
-
-            self.anim2.start()
-        else:
-            self.reply_Labels[self.entry_cnt-1].move(40, self.message_pos_y - self.reply_Labels[self.entry_cnt - 1].rect().height())
-            self.reply_Labels[self.entry_cnt-1].setVisible(True)
-            img_flag = False
-
-        self.show()
         # speak(reply, 200, 0.5)
-        self.scrollBar.setValue(self.message_pos_y)
-
-    # 用于拉动 Frame 时按钮等控件的位置跟随
-    def event(self, e):
-        if e.type() in (QEvent.Show, QEvent.Resize, QEvent.CursorChange, QEvent.MouseMove):
-            width = self.top_frame.rect().width()
-            height = self.top_frame.rect().height()
-            self.chat_area.resize(width, self.chat_area.rect().height())
-            self.scroll.resize(width - 4, height - 4)
-            self.scroll.move(2, 2)
-            width2 = self.bottom_frame.rect().width()
-            height2 = self.bottom_frame.rect().height()
-            # print(height, height2)
-            for i in range(self.entry_cnt):
-                self.Labels[i].move(width - self.Labels[i].rect().width() - 50, self.Labels[i].pos().y())
-
-            for i in range(self.entry_cnt):
-                self.reply_Labels[i].move(40, self.reply_Labels[i].pos().y())
-
-            for i in range(self.entry_cnt):
-                self.userAvatars[i].move(width - 45, self.userAvatars[i].pos().y())
-
-            self.btn.move(width2 - self.btn.width(), height2 - self.btn.height())
-            self.audio_btn.move(width2 - self.audio_btn.width(), 0)
-            self.audio_anim1.move(width2 - self.audio_btn.width(), \
-                                  (self.audio_btn.height() + height2 - self.btn.height()) // 2 - 62)
-            self.audio_anim2.move(width2 - self.audio_btn.width(), \
-                                  (self.audio_btn.height() + height2 - self.btn.height()) // 2 - 62)
-            self.input.resize(width2 - self.audio_btn.width(), height2)
-            self.histo_widget.input_widget_input.resize(self.rect().width() - 250, 50)
-            self.histo_widget.input_button.move(self.rect().width() - 175, 50)
-            self.histo_widget.output_widget_show.resize(self.rect().width() - 100, self.rect().height() - 200)
-        return QMainWindow.event(self, e)
+        if row == self.chat_model.rowCount() - 1:
+            self.chat_view.scrollToBottom()
 
     # 用于录音按钮按下后的动画
     def Audio_Cope(self):
@@ -560,6 +472,8 @@ class MainUI(QMainWindow):
             out.close()
             '''
 
+            # 把还在队列里的聊天记录写完
+            self.history.close()
             event.accept()
             # 接受退出事件，关闭组件和应用
         else:
@@ -5,6 +5,9 @@ from PIL import Image
 import ipinfo
 from selenium.webdriver.edge.options import Options
 from PIL import Image
+import matplotlib
+# 只画图不显示窗口，用不依赖 GUI 的后端；否则在 QApplication 里会选 Qt 后端，在工作线程里画图会崩溃
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import os
 
@@ -81,7 +84,8 @@ def weather():
     pic_path = r'C:\Users\86138\Desktop\Chatbot\pythonProject\weather_org.png'
     pic_save_dir_path = r'C:\Users\86138\Desktop\Chatbot\pythonProject\weather.png'
     left, upper, right, lower = 0, 50, 200, 125
-    show_cut(pic_path, left, upper, right, lower)
+    # 不再调用 show_cut：它只画对比图（plt.show() 早就注释掉了），
+    # 而 weather() / mytime() 现在在线程池里运行，在非 GUI 线程里创建 matplotlib 的 Qt 图窗会崩溃
     image_cut_save(pic_path, left, upper, right, lower, pic_save_dir_path)
 
 
@@ -102,7 +106,7 @@ def mytime():
     pic_path = r'C:\Users\86138\Desktop\Chatbot\pythonProject\time.png'
     pic_save_dir_path = r'C:\Users\86138\Desktop\Chatbot\pythonProject\time_out.png'
     left, upper, right, lower = 20, 420, 350, 650
-    show_cut(pic_path, left, upper, right, lower)
+    # 同 weather()，不在工作线程里调用 show_cut
     image_cut_save(pic_path, left, upper, right, lower, pic_save_dir_path)
 
 
@@ -49,13 +49,17 @@ chatnn.load_state_dict(model_state)
 chatnn.eval()
 
 
+# 预先建立 单词 -> 列号 的哈希索引，特征化时只处理句子里的单词
+word_index = {w: index for index, w in enumerate(words)}
+
+
 def trans_to_num(sen):
     # 这里的sentence已经是处理后的单词数组
     num_tmp = numpy.zeros(shape=len(words), dtype=numpy.float32)
     # numpy的数据格式有严格要求，此处先初始化
-    for index in range(len(words)):
-        if words[index] in sen:
-            num_tmp[index] = 1
+    for w in sen:
+        if w in word_index:
+            num_tmp[word_index[w]] = 1
     return num_tmp
 
 
@@ -4,7 +4,7 @@ import json
 import torch
 
 from model import NeuralNet
-from nltk_utils import bag_of_words, tokenize
+from nltk_utils import bag_of_words, tokenize, word_index
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
@@ -20,6 +20,8 @@ output_size = data["output_size"]
 all_words = data['all_words']
 tags = data['tags']
 model_state = data["model_state"]
+# word -> column index, built once for all sentences
+all_words_index = word_index(all_words)
 
 model = NeuralNet(input_size, hidden_size, output_size).to(device)
 model.load_state_dict(model_state)
@@ -34,7 +36,7 @@ while True:
         break
 
     sentence = tokenize(sentence)
-    X = bag_of_words(sentence, all_words)
+    X = bag_of_words(sentence, all_words, all_words_index)
     X = X.reshape(1, X.shape[0])
     X = torch.from_numpy(X).to(device)
 
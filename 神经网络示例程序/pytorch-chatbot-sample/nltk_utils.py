@@ -24,7 +24,7 @@ def stem(word):
     return stemmer.stem(word.lower())
 
 
-def bag_of_words(tokenized_sentence, words):
+def bag_of_words(tokenized_sentence, words, index=None):
     """
     return bag of words array:
     1 for each known word that exists in the sentence, 0 otherwise
@@ -32,13 +32,24 @@ def bag_of_words(tokenized_sentence, words):
     sentence = ["hello", "how", "are", "you"]
     words = ["hi", "hello", "I", "you", "bye", "thank", "cool"]
     bog   = [  0 ,    1 ,    0 ,   1 ,    0 ,    0 ,      0]
+    index is word_index(words); build it once and pass it in when calling this for many sentences
     """
     # stem each word
     sentence_words = [stem(word) for word in tokenized_sentence]
     # initialize bag with 0 for each word
     bag = np.zeros(len(words), dtype=np.float32)
-    for idx, w in enumerate(words):
-        if w in sentence_words: 
-            bag[idx] = 1
+    # look each word up in the word->column index instead of scanning the vocabulary
+    if index is None:
+        index = word_index(words)
+    for w in sentence_words:
+        if w in index:
+            bag[index[w]] = 1
 
     return bag
+
+
+def word_index(words):
+    """
+    return a word->column dict for the vocabulary
+    """
+    return {w: idx for idx, w in enumerate(words)}
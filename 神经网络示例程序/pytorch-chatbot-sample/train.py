@@ -6,7 +6,7 @@ import torch
 import torch.nn as nn
 from torch.utils.data import Dataset, DataLoader
 
-from nltk_utils import bag_of_words, tokenize, stem
+from nltk_utils import bag_of_words, tokenize, stem, word_index
 from model import NeuralNet
 
 with open('intents.json', 'r') as f:
@@ -42,9 +42,10 @@ print(len(all_words), "unique stemmed words:", all_words)
 # create training data
 X_train = []
 y_train = []
+all_words_index = word_index(all_words)
 for (pattern_sentence, tag) in xy:
     # X: bag of words for each pattern_sentence
-    bag = bag_of_words(pattern_sentence, all_words)
+    bag = bag_of_words(pattern_sentence, all_words, all_words_index)
     X_train.append(bag)
     # y: PyTorch CrossEntropyLoss needs only class labels, not one-hot
     label = tags.index(tag)